@@ -0,0 +1,88 @@
+"""
+Microbenchmark: matching audio-feature records onto a track pool (filter_audio).
+
+Compares the original list-scanning _apply_audio_features with the indexed version
+in spotify_mixer.py and checks that both keep the same tracks.
+
+    python Benchmarks/bench_audio_features.py --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import spotify_mixer
+from spotify_mixer import SpotifyMixer
+
+def legacy_apply_audio_features(tracks, features_list, min_bpm, max_bpm, min_energy, max_energy):
+    # Verbatim copy of the pre-index implementation, kept as the baseline
+    valid_tracks = []; isrc_map = {}
+    for t in tracks:
+        if t.get('external_ids', {}).get('isrc'):
+            isrc_map.setdefault(t['external_ids']['isrc'], []).append(t)
+    for f in features_list:
+        targets = []
+        if f.get('isrc') in isrc_map: targets = isrc_map[f['isrc']]
+        elif 'href' in f: 
+             try:
+                 sid = f['href'].split('track/')[-1].split('?')[0]
+                 targets = [t for t in tracks if t['id'] == sid]
+             except: pass
+        for t in targets:
+            try:
+                bpm, energy = float(f.get('tempo', 0)), float(f.get('energy', 0))
+                t['_audio_found'] = True
+                if (min_bpm <= bpm <= max_bpm) and (min_energy <= energy <= max_energy):
+                    t['bpm'], t['energy'] = bpm, energy
+                    if t not in valid_tracks: valid_tracks.append(t)
+            except: pass
+    return valid_tracks
+
+def make_pool(n, seed):
+    """Half of the tracks carry an ISRC, the rest can only be matched through the ReccoBeats href."""
+    rng = random.Random(seed); tracks, features = [], []
+    for i in range(n):
+        tid = f"{i:022d}"
+        t = {'id': tid, 'uri': f"spotify:track:{tid}", 'artists': [{'id': f"a{i % 997}"}]}
+        f = {'href': f"https://api.reccobeats.com/v1/track/{tid}", 'tempo': rng.uniform(60, 200), 'energy': rng.random()}
+        if i % 2 == 0:
+            t['external_ids'] = {'isrc': f"ISRC{i:08d}"}
+            f['isrc'] = t['external_ids']['isrc']
+        tracks.append(t)
+        if rng.random() < 0.9: features.append(f)
+    rng.shuffle(features)
+    return tracks, features
+
+def timed(fn, *args):
+    start = time.perf_counter(); res = fn(*args)
+    return time.perf_counter() - start, res
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--legacy-max', type=int, default=10000, help="Skip the quadratic baseline above this pool size.")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    mixer = SpotifyMixer.__new__(SpotifyMixer)
+    window = (120, 160, 0.5, 1.0)
+    print(f"NumPy: {'yes' if spotify_mixer.np is not None else 'no (pure Python fallback)'}")
+    print(f"{'tracks':>8} | {'legacy (s)':>10} | {'indexed (s)':>11} | {'speedup':>8} | kept")
+    for n in args.sizes:
+        tracks, features = make_pool(n, args.seed)
+        t_new, new = timed(mixer._apply_audio_features, [dict(t) for t in tracks], features, *window)
+        if n <= args.legacy_max:
+            t_old, old = timed(legacy_apply_audio_features, [dict(t) for t in tracks], features, *window)
+            assert [t['id'] for t in old] == [t['id'] for t in new], "indexed result differs from legacy result"
+            print(f"{n:>8} | {t_old:>10.3f} | {t_new:>11.3f} | {t_old / t_new:>7.1f}x | {len(new)}")
+        else:
+            print(f"{n:>8} | {'skipped':>10} | {t_new:>11.3f} | {'-':>8} | {len(new)}")
+
+        rows = [t.get('popularity', i % 100) for i, t in enumerate(tracks)]
+        t_sort, _ = timed(spotify_mixer.sort_order, rows, True)
+        print(f"{'':>8}   sort_order over {n} values: {t_sort:.3f}s")
+
+if __name__ == '__main__':
+    main()
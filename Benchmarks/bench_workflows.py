@@ -0,0 +1,190 @@
+"""
+End-to-end benchmark: runs workflows against the local fake Spotify service (fake_spotify.py)
+and reports wall time, API calls, bytes transferred and peak Python memory for every step.
+
+    python Benchmarks/bench_workflows.py                                  # Examples/workflow_*.json + synthetic 10k/50k/100k
+    python Benchmarks/bench_workflows.py --sizes 10000 --json bench.json  # save results
+    python Benchmarks/bench_workflows.py --baseline bench.json            # exit code 1 on regressions
+
+Placeholder IDs in the examples ('YOUR_..._ID') are mapped to fake playlists. Every workflow runs
+in its own temporary data directory with cold caches (add --warm to also measure a second run).
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import spotipy
+from spotify_mixer import SpotifyMixer, known_size, step_inputs
+from fake_spotify import FakeSpotify, FakeSpotifyProcess, spotify_id
+
+class BenchMixer(SpotifyMixer):
+    """SpotifyMixer wired to the fake service, recording metrics per executed step."""
+    server = None
+    run_peak = 0
+
+    def authenticate_user(self):
+        return self._configure_client(spotipy.Spotify(auth="bench-token", requests_session=self.http))
+
+    def authenticate_public(self):
+        return self.authenticate_user()
+
+    def execute_step(self, step):
+        if not step.get('action'): return super().execute_step(step)
+        size_in = sum(known_size(self.memory.get(n)) for n in step_inputs(step))
+        before = self.server.totals()
+        mem_start = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        if tracemalloc.is_tracing():
+            # Per-step peaks reset the run's peak, so keep the run maximum separately
+            self.run_peak = max(self.run_peak, tracemalloc.get_traced_memory()[1]); tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = super().execute_step(step)
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] - mem_start if tracemalloc.is_tracing() else 0
+        self.run_peak = max(self.run_peak, peak + mem_start)
+        after = self.server.totals()
+        self.step_metrics.append({'action': step['action'], 'output': step.get('output', 'temp'), 'wall_s': round(wall, 4),
+                                  'api_calls': after['calls'] - before['calls'], 'bytes': after['bytes'] - before['bytes'],
+                                  'throttled': after['throttled'] - before['throttled'], 'peak_mb': round(peak / 2**20, 2),
+                                  'in': size_in, 'out': known_size(result)})
+        return result
+
+def map_placeholders(workflow):
+    """Replaces 'YOUR_..._ID' placeholders with deterministic fake playlist IDs."""
+    text = json.dumps(workflow)
+    for key in set(part.split('"')[0] for part in text.split('"YOUR_')[1:]):
+        text = text.replace(f'"YOUR_{key}"', json.dumps(spotify_id(f"placeholder:{key}")))
+    return json.loads(text)
+
+def synthetic_workflow(n):
+    return [
+        {"action": "source", "id": f"bench{n:017d}", "hydrate": "false", "output": "pool_a"},
+        {"action": "source", "id": f"bench{n // 2:017d}", "hydrate": "false", "output": "pool_b"},
+        {"action": "source", "id": "me", "output": "liked"},
+        {"action": "source_file", "filename": "db_blocked_tracks.json", "output": "db_tracks"},
+        {"action": "source_file", "filename": "db_blocked_artists.json", "output": "db_artists"},
+        {"action": "mix", "inputs": ["pool_a", "pool_b", "liked"], "output": "pool"},
+        {"action": "dedup", "input": "pool", "output": "pool_dedup"},
+        {"action": "filter_exclude", "input": "pool_dedup", "exclude_input": "db_tracks", "output": "clean_1"},
+        {"action": "filter_artist", "input": "clean_1", "blacklist_input": "db_artists", "output": "clean_2"},
+        {"action": "filter_genre", "input": "clean_2", "genres": ["rock", "house"], "mode": "include", "output": "genre"},
+        {"action": "weighted_shuffle", "input": "genre", "by": "popularity", "factor": 50, "output": "shuffled"},
+        {"action": "artist_separation", "input": "shuffled", "min_distance": 10, "output": "separated"},
+        {"action": "slice", "input": "separated", "amount": 2000, "output": "top"},
+        {"action": "filter_audio", "input": "top", "min_bpm": 90, "max_bpm": 160, "output": "audio"},
+        {"action": "sort", "input": "audio", "by": "popularity", "output": "final"},
+        {"action": "save", "input": "final", "id": spotify_id(f"synthetic-target:{n}"), "mode": "diff"},
+    ]
+
+def write_blocklists(data_dir, n):
+    """Seeds the local databases used by the synthetic workflow (2% of the pool, 5 artists)."""
+    fake = FakeSpotify()  # Same deterministic catalogue as the server process
+    blocked = [fake.track(t) for t in fake.playlist_ids(f"bench{n:017d}")[::50]]
+    tracks = [{'id': t['id'], 'uri': t['uri'], 'name': t['name'], 'artists': [{'id': a['id'], 'name': a['name']} for a in t['artists']]} for t in blocked]
+    artists = [{'id': a['id'], 'name': a['name'], 'artists': [{'id': a['id']}]} for a in (fake.artist(i) for i in range(5))]
+    for name, items in (('db_blocked_tracks.json', tracks), ('db_blocked_artists.json', artists)):
+        with open(os.path.join(data_dir, name), 'w', encoding='utf-8') as f: json.dump({'tracks': items}, f)
+
+def run_workflow(name, workflow, server, args, setup=None):
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='mixer-bench-') as data_dir:
+        server.reset()
+        if setup: setup(data_dir)
+        config = {'credentials': {'client_id': 'bench', 'client_secret': 'bench', 'redirect_uri': 'http://localhost:8888/callback'},
+                  'settings': {'data_dir': data_dir, 'endpoints': server.endpoints,
+                               'network': {'requests_per_second': args.rps, 'reccobeats_requests_per_second': args.rps,
+                                           'concurrency': args.concurrency, 'engine': args.engine},
+                               'scheduler': {'parallel': args.parallel}, 'streaming': args.streaming},
+                  'workflow': workflow}
+        config_path = os.path.join(data_dir, 'bench_config.json')
+        with open(config_path, 'w', encoding='utf-8') as f: json.dump(config, f)
+
+        for label in (['cold', 'warm'] if args.warm else ['cold']):
+            BenchMixer.server = server
+            out = sys.stdout if args.verbose else io.StringIO()
+            if not args.no_memory: tracemalloc.start()
+            before = server.totals(); start = time.perf_counter()
+            with contextlib.redirect_stdout(out):
+                mixer = BenchMixer(config_path); mixer.step_metrics = []
+                mixer.run()
+            wall = time.perf_counter() - start; after = server.totals()
+            peak = max(mixer.run_peak, tracemalloc.get_traced_memory()[1]) if tracemalloc.is_tracing() else 0
+            if tracemalloc.is_tracing(): tracemalloc.stop()
+            runs.append({'workflow': name, 'run': label, 'wall_s': round(wall, 3), 'api_calls': after['calls'] - before['calls'],
+                         'bytes': after['bytes'] - before['bytes'], 'throttled': after['throttled'] - before['throttled'],
+                         'peak_mb': round(peak / 2**20, 2), 'steps': mixer.step_metrics})
+    return runs
+
+def print_run(run):
+    print(f"\n=== {run['workflow']} ({run['run']}) - {run['wall_s']:.2f}s, {run['api_calls']} API calls, "
+          f"{run['bytes'] / 2**20:.1f} MB transferred, {run['throttled']} x 429, peak {run['peak_mb']:.1f} MB ===")
+    print(f"  {'#':>3} {'action':<18} {'output':<18} {'wall (s)':>9} {'calls':>6} {'KB':>9} {'429':>4} {'peak MB':>8} {'in':>7} {'out':>7}")
+    for i, s in enumerate(run['steps'], 1):
+        print(f"  {i:>3} {s['action']:<18} {str(s['output'])[:18]:<18} {s['wall_s']:>9.3f} {s['api_calls']:>6} {s['bytes'] / 1024:>9.1f} "
+              f"{s['throttled']:>4} {s['peak_mb']:>8.2f} {s['in']:>7} {s['out']:>7}")
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['workflow'], r['run']): r for r in json.load(f)}
+    regressions = []
+    for r in results:
+        b = baseline.get((r['workflow'], r['run']))
+        if not b: continue
+        if r['wall_s'] > b['wall_s'] * (1 + tolerance) + 0.05:
+            regressions.append(f"{r['workflow']} ({r['run']}): wall time {b['wall_s']:.2f}s -> {r['wall_s']:.2f}s")
+        if r['api_calls'] > b['api_calls']:
+            regressions.append(f"{r['workflow']} ({r['run']}): API calls {b['api_calls']} -> {r['api_calls']}")
+        if b['peak_mb'] and r['peak_mb'] > b['peak_mb'] * (1 + tolerance):
+            regressions.append(f"{r['workflow']} ({r['run']}): peak memory {b['peak_mb']:.1f} MB -> {r['peak_mb']:.1f} MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--examples', default=os.path.join(os.path.dirname(BENCH_DIR), 'Examples', 'workflow_*.json'))
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10000, 50000, 100000], help="Synthetic workflow pool sizes.")
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--liked-size', type=int, default=12000, help="Size of the fake Liked Songs library ('me' source).")
+    parser.add_argument('--throttle-every', type=int, default=0, help="Inject a 429 every N requests.")
+    parser.add_argument('--rps', type=float, default=200, help="Client-side requests per second (the fake server has no quota).")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads', help="settings.network.engine for embed/ReccoBeats requests.")
+    parser.add_argument('--parallel', action='store_true', help="Enable the parallel step scheduler (per-step numbers then overlap).")
+    parser.add_argument('--streaming', action='store_true', help="Enable settings.streaming (lazy sources, 'in'/'out' count loaded tracks).")
+    parser.add_argument('--warm', action='store_true', help="Run every workflow a second time with warm caches.")
+    parser.add_argument('--no-memory', action='store_true', help="Skip tracemalloc (faster, no memory numbers).")
+    parser.add_argument('--verbose', action='store_true', help="Show the mixer's own output.")
+    parser.add_argument('--json', help="Write results to this file.")
+    parser.add_argument('--baseline', help="Compare against a previous --json file and exit 1 on regressions.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown against --baseline.")
+    args = parser.parse_args()
+
+    results = []
+    with FakeSpotifyProcess(latency_ms=args.latency_ms, throttle_every=args.throttle_every, liked_size=args.liked_size) as server:
+        print(f"Fake Spotify service at {server.url} (latency {args.latency_ms:.0f} ms)")
+        for path in sorted(glob.glob(args.examples)):
+            with open(path, 'r', encoding='utf-8') as f: workflow = map_placeholders(json.load(f)['workflow'])
+            results += run_workflow(os.path.basename(path), workflow, server, args)
+            for run in results[-(2 if args.warm else 1):]: print_run(run)
+        for n in args.sizes:
+            results += run_workflow(f"synthetic_{n}", synthetic_workflow(n), server, args, setup=lambda d, n=n: write_blocklists(d, n))
+            for run in results[-(2 if args.warm else 1):]: print_run(run)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        print("\n" + ("\n".join(f"REGRESSION: {r}" for r in regressions) if regressions else "No regressions against baseline."))
+        if regressions: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
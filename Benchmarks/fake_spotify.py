@@ -0,0 +1,385 @@
+"""
+Local stand-in for the Spotify Web API, the Spotify embed page and ReccoBeats.
+
+Serves deterministic data (the same ID always yields the same track), with fixed latency,
+pagination and optional 429 injection, so SpotifyMixer can be benchmarked without credentials.
+
+    python Benchmarks/fake_spotify.py --port 8999 --latency-ms 20 --throttle-every 500
+
+Point a workflow at it with:
+    "settings": {"endpoints": {"spotify_api": "http://127.0.0.1:8999/v1/",
+                               "embed": "http://127.0.0.1:8999/embed",
+                               "reccobeats": "http://127.0.0.1:8999/reccobeats/v1"}}
+
+Playlist IDs of the form 'bench' + 17 digits hold that many tracks (e.g. 'bench00000000000010000'),
+IDs starting with 'scrape' return 404 on the API so the embed scraper is used, and any other ID
+holds --default-size tracks. Counters are available at GET /__stats and reset with POST /__reset.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+MARKETS = ["AD", "AR", "AT", "AU", "BE", "BG", "BO", "BR", "CA", "CH", "CL", "CO", "CR", "CY", "CZ", "DE", "DK", "DO", "EC", "EE",
+           "ES", "FI", "FR", "GB", "GR", "GT", "HK", "HN", "HU", "ID", "IE", "IS", "IT", "JP", "LI", "LT", "LU", "LV", "MC", "MT",
+           "MX", "MY", "NI", "NL", "NO", "NZ", "PA", "PE", "PH", "PL", "PT", "PY", "SE", "SG", "SK", "SV", "TR", "TW", "US", "UY"]
+GENRES = ["dance pop", "pop rock", "deep house", "indie rock", "hip hop", "modern rock", "edm", "soul", "jazz fusion", "classic rock"]
+
+def _digest(seed):
+    return int(hashlib.sha1(seed.encode()).hexdigest(), 16)
+
+def spotify_id(seed):
+    """Deterministic 22-character base62 ID."""
+    n = _digest(seed); out = []
+    for _ in range(22): n, r = divmod(n, 62); out.append(BASE62[r])
+    return ''.join(out)
+
+def parse_fields(spec):
+    """Parses Spotify's `fields` syntax ('items(track(id,name)),next', 'tracks.total') into a tree."""
+    pos = 0
+    def parse_list():
+        nonlocal pos
+        tree = {}
+        while pos < len(spec) and spec[pos] != ')':
+            start = pos
+            while pos < len(spec) and spec[pos] not in ',().': pos += 1
+            name = spec[start:pos].strip(); sub = None
+            if pos < len(spec) and spec[pos] == '(':
+                pos += 1; sub = parse_list(); pos += 1
+            elif pos < len(spec) and spec[pos] == '.':
+                pos += 1; inner_start = pos; depth = 0
+                while pos < len(spec) and (depth or spec[pos] not in ',)'):
+                    depth += {'(': 1, ')': -1}.get(spec[pos], 0); pos += 1
+                sub = parse_fields(spec[inner_start:pos])
+            if name: tree[name] = sub
+            if pos < len(spec) and spec[pos] == ',': pos += 1
+        return tree
+    return parse_list()
+
+def project(obj, tree):
+    if tree is None: return obj
+    if isinstance(obj, list): return [project(x, tree) for x in obj]
+    if isinstance(obj, dict): return {k: project(obj[k], sub) for k, sub in tree.items() if k in obj}
+    return obj
+
+class FakeSpotify:
+    """Deterministic catalogue plus mutable playlist state and request counters."""
+    def __init__(self, default_size=100, liked_size=2000, catalog_size=200000, artist_count=500,
+                 recco_coverage=0.8, latency_ms=20, throttle_every=0, retry_after=1):
+        self.default_size, self.liked_size, self.catalog_size = default_size, liked_size, catalog_size
+        self.artist_count, self.recco_coverage = artist_count, recco_coverage
+        self.latency, self.throttle_every, self.retry_after = latency_ms / 1000.0, throttle_every, retry_after
+        self.lock = threading.Lock()
+        self.tracks = {}  # Catalogue data never changes, so it survives reset()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.playlists, self.snapshots, self.by_name = {}, {}, {}
+            self.requests, self.stats = 0, {}
+
+    # --- Catalogue ---
+    def artist(self, n):
+        aid = spotify_id(f"artist:{n}")
+        return {'id': aid, 'name': f"Artist {n}", 'uri': f"spotify:artist:{aid}", 'type': 'artist'}
+
+    def artist_full(self, aid):
+        h = _digest(aid)
+        return {'id': aid, 'name': f"Artist {aid[:6]}", 'uri': f"spotify:artist:{aid}", 'type': 'artist',
+                'genres': [GENRES[h % len(GENRES)], GENRES[(h // 7) % len(GENRES)]], 'popularity': h % 100}
+
+    def track(self, tid):
+        if tid not in self.tracks: self.tracks[tid] = self._make_track(tid)
+        return self.tracks[tid]
+
+    def _make_track(self, tid):
+        h = _digest(tid)
+        artists = [self.artist(h % self.artist_count)] + ([self.artist((h // 1000) % self.artist_count)] if h % 10 == 0 else [])
+        album_id = spotify_id(f"album:{h % 50000}")
+        t = {'id': tid, 'uri': f"spotify:track:{tid}", 'name': f"Song {tid[:8]}", 'type': 'track', 'artists': artists,
+             'popularity': h % 100, 'duration_ms': 120000 + h % 180000, 'explicit': bool(h % 3 == 0),
+             'external_ids': {'isrc': f"FAKE{h % 10**8:08d}"}, 'available_markets': MARKETS, 'is_local': False,
+             'album': {'id': album_id, 'name': f"Album {album_id[:6]}", 'uri': f"spotify:album:{album_id}", 'artists': artists[:1],
+                       'available_markets': MARKETS, 'release_date': f"{1970 + h % 55}-01-01",
+                       'images': [{'url': f"https://i.scdn.co/image/{album_id}{s}", 'height': s, 'width': s} for s in (640, 300, 64)]}}
+        self.by_name[t['name']] = tid
+        return t
+
+    def playlist_size(self, pid):
+        m = re.fullmatch(r'bench(\d{17})', pid)
+        return int(m.group(1)) if m else self.default_size
+
+    def playlist_ids(self, pid):
+        with self.lock:
+            if pid not in self.playlists:
+                size = self.liked_size if pid == '__liked__' else self.playlist_size(pid)
+                self.playlists[pid] = [spotify_id(f"track:{_digest(f'{pid}:{i}') % self.catalog_size}") for i in range(size)]
+                self.snapshots[pid] = 1
+            return self.playlists[pid]
+
+    def snapshot(self, pid):
+        self.playlist_ids(pid)
+        return f"snap{self.snapshots[pid]}"
+
+    def write(self, pid, ids):
+        with self.lock:
+            self.playlists[pid] = ids; self.snapshots[pid] = self.snapshots.get(pid, 0) + 1
+
+    def features(self, tid):
+        h = _digest(f"features:{tid}")
+        return {'id': tid, 'tempo': 70.0 + h % 110, 'energy': (h // 110 % 1000) / 1000.0}
+
+    # --- Accounting ---
+    def record(self, label, status, size):
+        with self.lock:
+            s = self.stats.setdefault(label, {'calls': 0, 'bytes': 0, 'throttled': 0})
+            s['calls'] += 1; s['bytes'] += size
+            if status == 429: s['throttled'] += 1
+
+    def next_request_throttled(self):
+        with self.lock:
+            self.requests += 1
+            return bool(self.throttle_every) and self.requests % self.throttle_every == 0
+
+    def totals(self):
+        with self.lock:
+            return {'calls': sum(s['calls'] for s in self.stats.values()), 'bytes': sum(s['bytes'] for s in self.stats.values()),
+                    'throttled': sum(s['throttled'] for s in self.stats.values())}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None  # set by FakeSpotifyServer
+
+    def log_message(self, *args): pass
+
+    def do_GET(self): self.dispatch('GET')
+    def do_POST(self): self.dispatch('POST')
+    def do_PUT(self): self.dispatch('PUT')
+    def do_DELETE(self): self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        path = url.path.rstrip('/')
+
+        if path == '/__stats': return self.reply('__stats', 200, {'totals': self.fake.totals(), 'endpoints': self.fake.stats}, count=False)
+        if path == '/__reset': self.fake.reset(); return self.reply('__reset', 200, {}, count=False)
+
+        time.sleep(self.fake.latency)
+        label, handler = self.route(method, path)
+        if handler is None: return self.reply(f"{method} unknown", 404, {'error': {'status': 404, 'message': 'Not found'}})
+        if self.fake.next_request_throttled():
+            return self.reply(label, 429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}}, headers={'Retry-After': str(self.fake.retry_after)})
+        status, payload, *headers = handler(query, body)
+        if 'fields' in query and status == 200 and isinstance(payload, dict): payload = project(payload, parse_fields(query['fields']))
+        self.reply(label, status, payload, headers=headers[0] if headers else None)
+
+    def route(self, method, path):
+        f = self.fake
+        m = re.fullmatch(r'/v1/playlists/([^/]+)/(tracks|items)', path)
+        if m:
+            pid = m.group(1)
+            return {'GET': (f"{method} playlists/{{id}}/items", lambda q, b: self.playlist_items(pid, q)),
+                    'POST': (f"{method} playlists/{{id}}/items", lambda q, b: self.playlist_add(pid, q, b)),
+                    'PUT': (f"{method} playlists/{{id}}/items", lambda q, b: self.playlist_put(pid, b)),
+                    'DELETE': (f"{method} playlists/{{id}}/items", lambda q, b: self.playlist_remove(pid, b))}.get(method, (None, None))
+        m = re.fullmatch(r'/v1/playlists/([^/]+)', path)
+        if m and method == 'GET':
+            pid = m.group(1)
+            if pid.startswith('scrape'): return "GET playlists/{id}", lambda q, b: (404, {'error': {'status': 404, 'message': 'Resource not found'}})
+            return "GET playlists/{id}", lambda q, b: (200, {'id': pid, 'name': f"Playlist {pid}", 'snapshot_id': f.snapshot(pid),
+                                                             'tracks': {'total': len(f.playlist_ids(pid))}})
+        m = re.fullmatch(r'/v1/(?:users/[^/]+|me)/playlists', path)
+        if m and method == 'POST':
+            def create(q, b):
+                pid = spotify_id(f"created:{time.time_ns()}"); f.write(pid, [])
+                return 201, {'id': pid, 'name': b.get('name'), 'snapshot_id': f.snapshot(pid)}
+            return "POST users/{id}/playlists", create
+        m = re.fullmatch(r'/embed/playlist/([^/]+)', path)
+        if m and method == 'GET': return "GET embed/playlist", lambda q, b: self.embed(m.group(1))
+        if method != 'GET': return None, None
+        routes = {
+            '/v1/me': ("GET me", lambda q, b: (200, {'id': 'bench-user', 'display_name': 'Bench User'})),
+            '/v1/me/tracks': ("GET me/tracks", lambda q, b: self.paged('__liked__', q, 50)),
+            '/v1/me/top/tracks': ("GET me/top/tracks", lambda q, b: (200, {'items': [f.track(t) for t in f.playlist_ids('__top__')[:int(q.get('limit', 20))]]})),
+            '/v1/tracks': ("GET tracks", lambda q, b: (200, {'tracks': [f.track(t) for t in q.get('ids', '').split(',') if t]})),
+            '/v1/artists': ("GET artists", lambda q, b: (200, {'artists': [f.artist_full(a) for a in q.get('ids', '').split(',') if a]})),
+            '/v1/audio-features': ("GET audio-features", lambda q, b: (200, {'audio_features': [f.features(t) for t in q.get('ids', '').split(',') if t]})),
+            '/v1/search': ("GET search", lambda q, b: self.search(q)),
+            '/reccobeats/v1/track': ("GET reccobeats/track", lambda q, b: self.reccobeats(q)),
+        }
+        return routes.get(path, (None, None))
+
+    # --- Endpoint implementations ---
+    def paged(self, pid, q, default_limit):
+        ids = self.fake.playlist_ids(pid)
+        offset, limit = int(q.get('offset', 0)), min(int(q.get('limit', default_limit)), 100)
+        items = [{'added_at': '2026-01-01T00:00:00Z', 'track': self.fake.track(t)} for t in ids[offset:offset + limit]]
+        nxt = None
+        if offset + limit < len(ids):
+            nq = dict(q, offset=offset + limit, limit=limit)
+            nxt = f"http://{self.headers['Host']}{urlparse(self.path).path}?{urlencode(nq)}"
+        return 200, {'items': items, 'total': len(ids), 'offset': offset, 'limit': limit, 'next': nxt, 'href': self.path}
+
+    def playlist_items(self, pid, q):
+        if pid.startswith('scrape'): return 404, {'error': {'status': 404, 'message': 'Resource not found'}}
+        return self.paged(pid, q, 100)
+
+    def playlist_add(self, pid, q, b):
+        # Spotipy posts a bare list of URIs (position in the query), the Web API also accepts {'uris', 'position'}
+        uris, pos = (b, q.get('position')) if isinstance(b, list) else (b.get('uris', []), b.get('position', q.get('position')))
+        ids = list(self.fake.playlist_ids(pid)); new = [u.split(':')[-1] for u in uris]
+        if pos is None: ids.extend(new)
+        else: ids[int(pos):int(pos)] = new
+        self.fake.write(pid, ids)
+        return 201, {'snapshot_id': self.fake.snapshot(pid)}
+
+    def playlist_put(self, pid, b):
+        if 'range_start' in b:
+            ids = list(self.fake.playlist_ids(pid)); start, length, before = b['range_start'], b.get('range_length', 1), b['insert_before']
+            seg = ids[start:start + length]; rest = ids[:start] + ids[start + length:]
+            before = before if before <= start else before - length
+            self.fake.write(pid, rest[:before] + seg + rest[before:])
+        else:
+            self.fake.write(pid, [u.split(':')[-1] for u in b.get('uris', [])])
+        return 200, {'snapshot_id': self.fake.snapshot(pid)}
+
+    def playlist_remove(self, pid, b):
+        drop = {(t['uri'] if isinstance(t, dict) else t).split(':')[-1] for t in b.get('tracks', b.get('items', []))}
+        self.fake.write(pid, [t for t in self.fake.playlist_ids(pid) if t not in drop])
+        return 200, {'snapshot_id': self.fake.snapshot(pid)}
+
+    def search(self, q):
+        m = re.search(r'track:(.*?) artist:', q.get('q', ''))
+        tid = self.fake.by_name.get(m.group(1)) if m else None
+        return 200, {'tracks': {'items': [self.fake.track(tid)] if tid else [], 'total': 1 if tid else 0}}
+
+    def reccobeats(self, q):
+        content = []
+        for tid in q.get('ids', '').split(','):
+            if not tid or _digest(f"recco:{tid}") % 1000 >= self.fake.recco_coverage * 1000: continue
+            feats = self.fake.features(tid)
+            content.append({'href': f"https://open.spotify.com/track/{tid}", 'isrc': self.fake.track(tid)['external_ids']['isrc'],
+                            'tempo': feats['tempo'], 'energy': feats['energy']})
+        return 200, {'content': content}
+
+    def embed(self, pid):
+        # The page changes with the playlist's snapshot, so conditional requests can get a 304
+        etag = f'"{pid}-{self.fake.snapshot(pid)}"'
+        if self.headers.get('If-None-Match') == etag: return 304, '', {'ETag': etag}
+        tracks = [self.fake.track(t) for t in self.fake.playlist_ids(pid)]
+        state = {'props': {'pageProps': {'state': {'data': {'entity': {
+            'type': 'playlist', 'uri': f"spotify:playlist:{pid}", 'name': f"Playlist {pid}",
+            'trackList': [{'uri': t['uri'], 'uid': t['id'][:16], 'title': t['name'], 'subtitle': ', '.join(a['name'] for a in t['artists']),
+                           'duration': t['duration_ms'], 'isExplicit': t['explicit'], 'isPlayable': True} for t in tracks]}}}}}}
+        html = ("<!DOCTYPE html><html><head><title>Spotify Embed</title></head><body><div id=\"main\"></div>"
+                f"<script id=\"__NEXT_DATA__\" type=\"application/json\">{json.dumps(state)}</script></body></html>")
+        return 200, html, {'ETag': etag}
+
+    def reply(self, label, status, payload, headers=None, count=True):
+        is_html = isinstance(payload, str)
+        data = (payload if is_html else json.dumps(payload)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8' if is_html else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+        if count: self.fake.record(label, status, len(data))
+
+class FakeSpotifyServer:
+    """Runs the fake service on a background thread: `with FakeSpotifyServer() as srv: srv.endpoints`."""
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.fake = FakeSpotify(**options)
+        handler = type('BoundHandler', (Handler,), {'fake': self.fake})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def endpoints(self):
+        return endpoints_for(self.url)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown(); self.httpd.server_close()
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc): self.stop()
+
+def endpoints_for(url):
+    """The `settings.endpoints` block that points SpotifyMixer at a fake service running at `url`."""
+    return {'spotify_api': f"{url}/v1/", 'embed': f"{url}/embed", 'reccobeats': f"{url}/reccobeats/v1"}
+
+def _serve(queue, options):
+    server = FakeSpotifyServer(**options)
+    queue.put(server.url)
+    server.httpd.serve_forever()
+
+class FakeSpotifyProcess:
+    """
+    Runs the fake service in a child process, so its CPU time and allocations stay out of the
+    client's measurements. Counters are read over HTTP: `with FakeSpotifyProcess() as srv: srv.totals()`.
+    """
+    def __init__(self, **options):
+        self.options = options; self.proc = None; self.url = None
+
+    @property
+    def endpoints(self):
+        return endpoints_for(self.url)
+
+    def _request(self, path, method='GET'):
+        req = urllib.request.Request(f"{self.url}{path}", method=method, data=b'' if method == 'POST' else None)
+        with urllib.request.urlopen(req, timeout=10) as resp: return json.loads(resp.read() or b'{}')
+
+    def totals(self): return self._request('/__stats')['totals']
+    def endpoint_stats(self): return self._request('/__stats')['endpoints']
+    def reset(self): self._request('/__reset', method='POST')
+
+    def __enter__(self):
+        ctx = multiprocessing.get_context('spawn'); queue = ctx.Queue()
+        self.proc = ctx.Process(target=_serve, args=(queue, self.options), daemon=True)
+        self.proc.start()
+        self.url = queue.get(timeout=30)
+        return self
+
+    def __exit__(self, *exc):
+        self.proc.terminate(); self.proc.join()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--default-size', type=int, default=100, help="Tracks per playlist unless the ID encodes a size.")
+    parser.add_argument('--liked-size', type=int, default=2000, help="Size of the 'me' (Liked Songs) library.")
+    parser.add_argument('--throttle-every', type=int, default=0, help="Answer every Nth request with 429 (0 = never).")
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+    server = FakeSpotifyServer(args.host, args.port, latency_ms=args.latency_ms, default_size=args.default_size,
+                               liked_size=args.liked_size, throttle_every=args.throttle_every, retry_after=args.retry_after)
+    print(f"Fake Spotify listening on {server.url}")
+    print(json.dumps({'settings': {'endpoints': server.endpoints}}, indent=2))
+    try: server.httpd.serve_forever()
+    except KeyboardInterrupt: server.stop()
+
+if __name__ == '__main__':
+    main()
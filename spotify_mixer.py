@@ -1,27 +1,796 @@
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth, SpotifyClientCredentials
+import argparse
+import asyncio
+import contextvars
+import cProfile
+import hashlib
 import os
 import random
 import json
 import sys
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import islice
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import sqlite3
+import threading
+import tracemalloc
+import weakref
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+try:
+    import numpy as np  # Optional: speeds up range filters and sorting on large pools
+except ImportError:
+    np = None
+
+# Both are imported on first use, so local-only workflows start without them
+spotipy = None
+aiohttp = None  # Optional: asyncio engine for ReccoBeats batches (settings.network.engine)
+
+def import_spotipy():
+    global spotipy
+    if spotipy is None: import spotipy.oauth2
+    return spotipy
+
+def import_aiohttp():
+    global aiohttp
+    if aiohttp is None:
+        try: import aiohttp
+        except ImportError: pass
+    return aiohttp
+
+class OfflineError(RuntimeError):
+    """A step needs the network while offline mode is on."""
+
+blocked_requests = contextvars.ContextVar('blocked_requests', default=None)  # Offline mode: requests the running step tried to make
+
+class OfflineAdapter(HTTPAdapter):
+    """Transport for offline mode: every request fails at once instead of waiting for a timeout."""
+    def __init__(self, blocked):
+        super().__init__()
+        self.blocked = blocked
+
+    def send(self, request, **kwargs):
+        raise self.blocked(f"{request.method} {urlsplit(request.url).netloc}")
+
+STEP_INPUT_KEYS = ('input', 'inputs', 'inject_input', 'exclude_input', 'filter_input', 'blacklist_input')
+
+def step_inputs(step):
+    """Memory names a step reads, once per reference."""
+    return [name for key in STEP_INPUT_KEYS for name in (step[key] if isinstance(step.get(key), list) else [step.get(key)]) if name]
+
+# Memoized with settings.memoize: pure steps always, random ones only with a `seed`
+# Not filter_audio: it also writes bpm/energy onto its input tracks, which a stored result cannot repeat
+PURE_ACTIONS = {'dedup', 'filter_exclude', 'filter_artist', 'filter_genre', 'sort', 'slice'}
+SEEDED_ACTIONS = {'sample', 'mix', 'inject', 'weighted_shuffle', 'artist_separation'}
+MEMO_VERSION = 1  # Bump when an action's output changes, so stored results are not reused
+failed_lookups = contextvars.ContextVar('failed_lookups', default=None)  # Metadata lookups of the running step that failed
+
+def lookup_failed(what):
+    """Marks the running step's result as based on incomplete metadata, so it is not memoized."""
+    failed = failed_lookups.get()
+    if failed is not None: failed.append(what)
+
+# Track object fields the Web API can filter playlist items by
+TRACK_FIELDS = {'album', 'artists', 'available_markets', 'disc_number', 'duration_ms', 'explicit', 'external_ids', 'external_urls',
+                'href', 'id', 'is_local', 'is_playable', 'linked_from', 'name', 'popularity', 'preview_url', 'track_number', 'type', 'uri'}
+
+EMBED_FIELDS = {'id', 'uri', 'name', 'duration_ms', 'explicit'}  # Track fields an embed page provides (parse_embed_tracks)
+EMBED_VERSION = 2  # Bump when parse_embed_tracks changes, so cached embed pages are parsed again
+
+def parse_embed_tracks(html):
+    """
+    Partial track records from an embed page: its __NEXT_DATA__ state lists uri, title and duration per track.
+    Artists are left out: the page has no artist IDs, and its comma-joined names cannot be split reliably.
+    Pages without the state fall back to the bare spotify:track: IDs in the HTML.
+    """
+    m = re.search(r'<script id="__NEXT_DATA__"[^>]*>(.*?)</script>', html, re.S)
+    if m:
+        try:
+            stack = [json.loads(m.group(1))]
+            while stack:
+                node = stack.pop()
+                if isinstance(node, dict):
+                    if isinstance(node.get('trackList'), list):
+                        tracks = {}
+                        for item in node['trackList']:
+                            uri = item.get('uri') or ''
+                            if not re.fullmatch(r'spotify:track:[a-zA-Z0-9]{22}', uri) or uri in tracks: continue
+                            tracks[uri] = {'id': uri.split(':')[-1], 'uri': uri, 'name': item.get('title'),
+                                           'duration_ms': item.get('duration'), 'explicit': bool(item.get('isExplicit'))}
+                        if tracks: return list(tracks.values())
+                    stack.extend(node.values())
+                elif isinstance(node, list): stack.extend(node)
+        except ValueError: pass
+    ids = list(dict.fromkeys(re.findall(r'spotify:track:([a-zA-Z0-9]{22})', html)))
+    return [{'id': tid, 'uri': f"spotify:track:{tid}"} for tid in ids]
+
+def as_response(url, status, headers, body, elapsed):
+    """Wraps a result from another HTTP client in a requests.Response, so callers and response hooks can share it."""
+    resp = requests.Response()
+    resp.status_code, resp._content, resp.url = status, body, url
+    resp.headers = requests.structures.CaseInsensitiveDict(headers)
+    resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+    resp.elapsed = timedelta(seconds=elapsed)
+    resp.request = requests.Request('GET', url).prepare()
+    return resp
+
+def range_mask(values, low, high):
+    """Returns [low <= v <= high for v in values], vectorised with NumPy when available."""
+    if np is not None and len(values) > 0:
+        arr = np.asarray(values, dtype=float)
+        return ((arr >= low) & (arr <= high)).tolist()
+    return [low <= v <= high for v in values]
+
+def sort_order(values, reverse=False):
+    """Returns the indices that sort `values` with the same (stable) tie order as sorted()."""
+    if np is not None and len(values) > 0:
+        try: arr = np.asarray(values, dtype=float)
+        except (TypeError, ValueError): arr = None
+        if arr is not None and not np.isnan(arr).any():
+            return np.argsort(-arr if reverse else arr, kind='stable').tolist()
+    return sorted(range(len(values)), key=values.__getitem__, reverse=reverse)
+
+def longest_increasing_subsequence(values):
+    """Returns the set of indices of one longest strictly increasing subsequence (O(n log n))."""
+    tails, tail_idx, prev = [], [], [-1] * len(values)
+    for i, v in enumerate(values):
+        j = bisect_left(tails, v)
+        if j == len(tails): tails.append(v); tail_idx.append(i)
+        else: tails[j] = v; tail_idx[j] = i
+        prev[i] = tail_idx[j - 1] if j else -1
+    keep = set(); i = tail_idx[-1] if tail_idx else -1
+    while i >= 0: keep.add(i); i = prev[i]
+    return keep
+
+class KeywordMatcher:
+    """Aho-Corasick automaton: checks whether any of the keywords occurs in a text in a single pass."""
+    def __init__(self, keywords):
+        self.goto, self.fail, self.out = [{}], [0], [False]
+        for word in keywords:
+            state = 0
+            for ch in word:
+                if ch not in self.goto[state]:
+                    self.goto.append({}); self.fail.append(0); self.out.append(False)
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.out[state] = True
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]: f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if state else 0
+                self.out[nxt] = self.out[nxt] or self.out[self.fail[nxt]]
+
+    def search(self, text):
+        state = 0
+        if self.out[0]: return True
+        for ch in text:
+            while state and ch not in self.goto[state]: state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            if self.out[state]: return True
+        return False
+
+class Track:
+    """
+    Compact track record for the workflow memory. The fields actions read are slots, artists are shared
+    {'id', 'name'} dicts, and other kept fields (track_fields, bpm/energy from filter_audio) live in `extra`.
+    Reads and writes like the Spotify track dict it replaces.
+    """
+    __slots__ = ('id', 'uri', 'name', 'artists', 'popularity', 'external_ids', 'extra')
+    FIELDS = __slots__[:-1]
+
+    def __init__(self, data, keep=None, artist=None):
+        self.extra = None
+        for key, value in data.items():
+            if key == 'artists': value = tuple(artist(a) for a in value or ()) if artist else value
+            if key in Track.FIELDS or keep is None or key in keep: self[key] = value
+
+    def __getitem__(self, key):
+        if key in Track.FIELDS:
+            try: return getattr(self, key)
+            except AttributeError: raise KeyError(key) from None
+        if self.extra and key in self.extra: return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in Track.FIELDS: setattr(self, key, value)
+        elif self.extra is None: self.extra = {key: value}
+        else: self.extra[key] = value
+
+    def __contains__(self, key):
+        return hasattr(self, key) if key in Track.FIELDS else bool(self.extra) and key in self.extra
+
+    def get(self, key, default=None):
+        try: return self[key]
+        except KeyError: return default
+
+    def keys(self):
+        return [k for k in Track.FIELDS if hasattr(self, k)] + list(self.extra or ())
+
+    def to_dict(self):
+        return {k: self[k] for k in self.keys()}
+
+    def copy(self):
+        """A separate record that shares the (read-only) artists; writes such as bpm/energy stay on the copy."""
+        t = Track.__new__(Track)
+        for key in Track.__slots__:
+            if hasattr(self, key): setattr(t, key, getattr(self, key))
+        if t.extra: t.extra = dict(t.extra)
+        return t
+
+    def __repr__(self):
+        return f"Track({self.to_dict()!r})"
+
+class LazyTracks:
+    """
+    Streaming mode: a track list that is loaded on demand, so consumers that stop early (slice, sample,
+    a satisfied filter chain) never trigger the remaining requests. Wraps either an iterable (derived steps)
+    or numbered pages, `load_page(i)` -> tracks with None for unavailable items, which also allows random access.
+    With `buffer`, loaded tracks are kept so several steps can read the list; without it, it can be read once.
+    """
+    def __init__(self, source=(), load_page=None, total=0, page_size=1, map_pages=None, prefetch=1, buffer=True, on_complete=None):
+        self.lock = threading.RLock()
+        self.load_page, self.total, self.page_size = load_page, total, page_size
+        self.map_pages = map_pages or (lambda fn, items: [fn(i) for i in items])
+        self.prefetch = max(1, prefetch)
+        self.page_cache = {}
+        self.buffer, self.on_complete = buffer, on_complete
+        self.items, self.done, self.consumed, self.passed = [], False, False, 0
+        self.chunks = self._paged_chunks() if load_page else ([t] for t in source)
+
+    @property
+    def loaded(self):
+        return len(self.items) if self.buffer else self.passed
+
+    def _pages(self, indices):
+        with self.lock:
+            todo = [i for i in indices if i not in self.page_cache]
+            for i, page in zip(todo, self.map_pages(self.load_page, todo)): self.page_cache[i] = page
+            return [self.page_cache[i] for i in indices]
+
+    def _paged_chunks(self):
+        # Ramp up (1, 2, 4, ... pages at once, at most `prefetch`), so a consumer that needs little loads little
+        i, window, count = 0, 1, (self.total + self.page_size - 1) // self.page_size
+        while i < count:
+            indices = list(range(i, min(count, i + window)))
+            for j, page in zip(indices, self._pages(indices)):
+                with self.lock: self.page_cache.pop(j, None)
+                yield [t for t in page if t is not None]
+            i += len(indices); window = min(self.prefetch, window * 2)
+
+    def __iter__(self):
+        if not self.buffer:
+            with self.lock:
+                if self.consumed: raise RuntimeError("Unbuffered stream was already read.")
+                self.consumed = True
+            # The completion callback (source cache) needs the full list, so only keep one if it is set
+            kept = [] if self.on_complete else None
+            for chunk in self.chunks:
+                self.passed += len(chunk)
+                if kept is not None: kept.extend(chunk)
+                yield from chunk
+            self.done = True
+            if kept is not None: self.on_complete(kept)
+            return
+        i = 0
+        while True:
+            with self.lock:
+                while i >= len(self.items) and not self.done:
+                    chunk = next(self.chunks, None)
+                    if chunk is None:
+                        self.done = True
+                        if self.on_complete: self.on_complete(self.items)
+                    else: self.items.extend(chunk)
+                if i >= len(self.items): return
+                item = self.items[i]
+            yield item
+            i += 1
+
+    def materialize(self):
+        return list(self)
+
+    def sample(self, k, rng=random):
+        """Like random.sample(): paged lists load only the pages holding the picked positions, streams use reservoir sampling."""
+        with self.lock:
+            if self.done and self.buffer: return rng.sample(self.items, min(k, len(self.items)))
+        if not self.load_page:
+            reservoir = []
+            for n, t in enumerate(self):
+                if n < k: reservoir.append(t)
+                else:
+                    j = rng.randrange(n + 1)
+                    if j < k: reservoir[j] = t
+            rng.shuffle(reservoir)
+            return reservoir
+        result, order = [], rng.sample(range(self.total), self.total)
+        start = 0
+        # Positions holding unavailable items are skipped, so picks continue until k tracks are found
+        while len(result) < k and start < len(order):
+            picks = order[start:start + k - len(result)]; start += len(picks)
+            needed = sorted({pos // self.page_size for pos in picks})
+            pages = dict(zip(needed, self._pages(needed)))
+            for pos in picks:
+                page, offset = pages[pos // self.page_size], pos % self.page_size
+                if offset < len(page) and page[offset] is not None: result.append(page[offset])
+        return result
+
+def known_size(tracks):
+    """Length of a track list without loading a lazy one (streaming mode counts the tracks loaded so far)."""
+    return tracks.loaded if isinstance(tracks, LazyTracks) else len(tracks or [])
+
+class MetadataCache:
+    """Persistent key/value store (SQLite) for API metadata that is reused between runs."""
+    def __init__(self, path, max_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self.stats = {}
+        self.allow_stale = False  # Offline mode also returns expired entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS entries (ns TEXT, key TEXT, value TEXT, expires_at REAL, accessed_at REAL, PRIMARY KEY (ns, key))")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (ns, accessed_at)")
+
+    def _count(self, ns, key, n):
+        with self.lock:
+            bucket = self.stats.setdefault(ns, {'hits': 0, 'misses': 0})
+            bucket[key] += n
+
+    def record(self, ns, hits, misses):
+        self._count(ns, 'hits', hits); self._count(ns, 'misses', misses)
+
+    def get_many(self, ns, keys, count=True):
+        """Returns {key: value} for all keys that are cached and not expired. With `count=False` the caller record()s hits and misses."""
+        keys = list(dict.fromkeys(keys)); found = {}; now = time.time()
+        valid_after = 0 if self.allow_stale else now
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                rows = self.conn.execute(f"SELECT key, value FROM entries WHERE ns = ? AND expires_at > ? AND key IN ({','.join('?' * len(chunk))})", [ns, valid_after] + chunk).fetchall()
+                for k, v in rows: found[k] = json.loads(v)
+            if found:
+                with self.conn:
+                    self.conn.executemany("UPDATE entries SET accessed_at = ? WHERE ns = ? AND key = ?", [(now, ns, k) for k in found])
+        if count: self.record(ns, len(found), len(keys) - len(found))
+        return found
+
+    def put_many(self, ns, items, ttl):
+        """Stores {key: value}; entries expire after `ttl` seconds."""
+        if not items: return
+        now = time.time()
+        rows = [(ns, k, json.dumps(v, default=Track.to_dict), now + ttl, now) for k, v in items.items()]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+            # Expired entries are what an offline run falls back on, so they are kept until the next online run
+            if not self.allow_stale: self.conn.execute("DELETE FROM entries WHERE ns = ? AND expires_at <= ?", (ns, now))
+            # Size bound: evict least recently used entries of this namespace
+            overflow = self.conn.execute("SELECT COUNT(*) FROM entries WHERE ns = ?", (ns,)).fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self.conn.execute("DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries WHERE ns = ? ORDER BY accessed_at LIMIT ?)", (ns, overflow))
+
+    def report(self, ns, since=None):
+        """Hit/miss counts of a namespace, optionally only those after the `since` snapshot of `stats`."""
+        s = self.stats.get(ns, {'hits': 0, 'misses': 0}); base = (since or {}).get(ns, {'hits': 0, 'misses': 0})
+        return f"{s['hits'] - base['hits']} hits, {s['misses'] - base['misses']} misses"
+
+class LocalDatabase:
+    """
+    Local track/artist database (blocklists etc.) stored in SQLite with a unique ID index.
+    Appends and removals touch only the affected rows and commit atomically.
+    A legacy '{"tracks": [...]}' JSON file is migrated once and kept as '<name>.json.bak'.
+    """
+    def __init__(self, json_path):
+        self.json_path = json_path
+        self.path = os.path.splitext(json_path)[0] + '.sqlite'
+        self.lock = threading.Lock()
+        self._rows = None; self._version = None
+        if not os.path.exists(self.path) and os.path.exists(json_path): self._migrate()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn: self._create(self.conn)
+
+    @staticmethod
+    def _create(conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS items (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, data TEXT NOT NULL)")
+
+    def _migrate(self):
+        with open(self.json_path, 'r', encoding='utf-8') as f: items = json.load(f).get('tracks', [])
+        # Build the new file next to the target and swap it in, so a crash never leaves a half-written DB
+        tmp_path = self.path + '.tmp'
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        with conn:
+            self._create(conn)
+            conn.executemany("INSERT OR IGNORE INTO items (id, data) VALUES (?, ?)", [(item['id'], json.dumps(item)) for item in items if item.get('id')])
+        conn.close()
+        os.replace(tmp_path, self.path)
+        os.replace(self.json_path, self.json_path + '.bak')
+        print(f"    > Migrated '{os.path.basename(self.json_path)}' ({len(items)} items) to {os.path.basename(self.path)}.")
+
+    def all(self):
+        with self.lock:
+            # data_version changes when another connection (or process) commits
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._rows is None or version != self._version:
+                self._rows = [json.loads(data) for (data,) in self.conn.execute("SELECT data FROM items ORDER BY seq")]
+                self._version = version
+            return [dict(item) for item in self._rows]
+
+    def add(self, entries):
+        """Inserts entries whose ID is not stored yet. Returns the number of new rows."""
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO items (id, data) VALUES (?, ?)", [(e['id'], json.dumps(e)) for e in entries])
+            added = self.conn.total_changes - before
+            if added: self._rows = None
+            return added
+
+    def remove(self, ids):
+        """Deletes entries by ID. Returns the number of removed rows."""
+        ids = list(ids)
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i+500]
+                self.conn.execute(f"DELETE FROM items WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            removed = self.conn.total_changes - before
+            if removed: self._rows = None
+            return removed
+
+class RateLimiter:
+    """Token bucket shared by all worker threads. Halves its rate on HTTP 429 and recovers gradually."""
+    def __init__(self, rate=10.0, burst=None):
+        self.max_rate = self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + max(0, now - self.updated) * self.rate)
+                self.updated = max(self.updated, now)
+                if self.tokens >= 1 and now >= self.updated:
+                    self.tokens -= 1
+                    return
+                wait = max(self.updated - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def throttled(self, retry_after):
+        # Nobody may send until Retry-After has passed; afterwards continue at half speed
+        with self.lock:
+            self.updated = max(self.updated, time.monotonic() + retry_after)
+            self.tokens = 0
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def succeeded(self):
+        with self.lock: self.rate = min(self.max_rate, self.rate * 1.05)
+
+current_step = contextvars.ContextVar('current_step', default=None)  # Profiling record of the running step
+
+def endpoint_name(method, url):
+    """'GET api.spotify.com/v1/playlists/{id}/tracks': the URL with Spotify IDs replaced, for grouping calls."""
+    parts = urlsplit(url)
+    return f"{method} {parts.netloc}{re.sub(r'/[A-Za-z0-9]{22}(?=/|$)', '/{id}', parts.path)}"
+
+class RunProfiler:
+    """
+    Records per step: wall time, API calls per endpoint, retries and 429s, bytes received,
+    input/output sizes and peak Python memory. finish() writes a JSON summary and a
+    Chrome/Perfetto trace (open in ui.perfetto.dev or chrome://tracing).
+    """
+    def __init__(self, out_dir, memory=True, cprofile_step=None):
+        self.out_dir = out_dir
+        self.memory = memory
+        self.cprofile_step = None if cprofile_step is None else str(cprofile_step)
+        self.lock = threading.Lock()
+        self.steps, self.events, self.active, self.threads = [], [], {}, {}
+        self.totals = self._counters()
+        self.t0 = time.perf_counter()
+        self.stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.own_tracing = memory and not tracemalloc.is_tracing()
+        if self.own_tracing: tracemalloc.start()
+
+    @staticmethod
+    def _counters():
+        return {'api_calls': 0, 'bytes': 0, 'throttled': 0, 'retries': 0, 'endpoints': {}}
+
+    def _us(self, t):
+        return round((t - self.t0) * 1e6)
+
+    def _buckets(self):
+        # Run totals, plus the step this thread works for (if any)
+        rec = current_step.get()
+        return [self.totals, rec] if rec else [self.totals]
+
+    def _event(self, **event):
+        tid = threading.get_native_id()
+        with self.lock:
+            self.threads.setdefault(tid, threading.current_thread().name)
+            self.events.append({'pid': 1, 'tid': tid, **event})
+
+    def record_response(self, resp, *args, **kwargs):
+        """requests response hook: one API call (after transport-level retries)."""
+        end = time.perf_counter(); elapsed = resp.elapsed.total_seconds()
+        name = endpoint_name(resp.request.method, resp.url)
+        size = int(resp.headers.get('Content-Length') or len(resp.content or b''))
+        rec = current_step.get()
+        with self.lock:
+            for bucket in self._buckets():
+                bucket['api_calls'] += 1; bucket['bytes'] += size
+                bucket['endpoints'][name] = bucket['endpoints'].get(name, 0) + 1
+                if resp.status_code == 429: bucket['throttled'] += 1
+        self._event(name=name, cat='http', ph='X', ts=self._us(end - elapsed), dur=round(elapsed * 1e6),
+                    args={'status': resp.status_code, 'bytes': size, 'step': rec and rec['output']})
+        return resp
+
+    def record_retry(self, status=None):
+        """Counts one retry. `status` is given for responses the response hook never sees."""
+        with self.lock:
+            for bucket in self._buckets():
+                bucket['retries'] += 1
+                if status == 429: bucket['throttled'] += 1
+        self._event(name=f"retry ({status or 'client'})", cat='retry', ph='i', s='t', ts=self._us(time.perf_counter()))
+
+    def observe_retries(self, session):
+        """Reports the retries urllib3 performs inside a session (spotipy waits out some 429s itself)."""
+        profiler = self
+        for adapter in set(session.adapters.values()):
+            retry = getattr(adapter, 'max_retries', None)
+            if retry is None or getattr(retry, 'observed', False): continue
+            class ObservedRetry(type(retry)):
+                observed = True
+                def increment(self, method=None, url=None, response=None, *args, **kwargs):
+                    profiler.record_retry(response.status if response is not None else None)
+                    return super().increment(method, url, response, *args, **kwargs)
+            retry.__class__ = ObservedRetry
+
+    @contextmanager
+    def step(self, index, step, size_in):
+        rec = {'step': index, 'action': step['action'], 'output': step.get('output', 'temp'), 'in': size_in, 'out': 0, **self._counters()}
+        with self.lock:
+            # tracemalloc has one global peak: steps running at the same time share it
+            rec['memory_shared'] = bool(self.active)
+            for other in self.active.values(): other['memory_shared'] = True
+            if self.memory and not self.active: tracemalloc.reset_peak()
+            self.active[id(rec)] = rec
+        mem_start = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        prof = cProfile.Profile() if self.cprofile_step in (str(index), rec['output']) else None
+        token = current_step.set(rec); start = time.perf_counter()
+        if prof: prof.enable()
+        try:
+            yield rec
+        except Exception as e:
+            rec['error'] = str(e)[:200]
+            raise
+        finally:
+            if prof: prof.disable()
+            end = time.perf_counter(); current_step.reset(token)
+            rec['wall_s'] = round(end - start, 4)
+            if self.memory: rec['peak_mb'] = round((tracemalloc.get_traced_memory()[1] - mem_start) / 2**20, 2)
+            with self.lock:
+                del self.active[id(rec)]
+                self.steps.append(rec)
+            self._event(name=f"{rec['action']} -> {rec['output']}", cat='step', ph='X', ts=self._us(start), dur=round((end - start) * 1e6),
+                        args={k: rec[k] for k in ('in', 'out', 'api_calls', 'bytes', 'throttled', 'retries')})
+            if prof: self._dump_cprofile(prof, rec)
+
+    def _dump_cprofile(self, prof, rec):
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = re.sub(r'[^\w.-]', '_', str(rec['output']))
+        path = os.path.join(self.out_dir, f"profile_{self.stamp}_step{rec['step']}_{name}.prof")
+        prof.dump_stats(path)
+        print(f"    > cProfile of step {rec['step']} written to {path}")
+
+    def finish(self, cache_stats=None):
+        """Writes '<dir>/profile_<time>.json' and '.trace.json', prints a per-step table and returns the summary."""
+        steps = sorted(self.steps, key=lambda r: r['step'])
+        summary = {'started': self.stamp, 'wall_s': round(time.perf_counter() - self.t0, 3), **self.totals,
+                   'steps': steps, 'cache': cache_stats or {}}
+        meta = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}} for tid, name in self.threads.items()]
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, f"profile_{self.stamp}")
+        with open(base + '.json', 'w', encoding='utf-8') as f: json.dump(summary, f, indent=2)
+        with open(base + '.trace.json', 'w', encoding='utf-8') as f: json.dump({'traceEvents': meta + self.events, 'displayTimeUnit': 'ms'}, f)
+        if self.own_tracing: tracemalloc.stop()
+
+        print(f"\n--- Profile Summary ({summary['wall_s']:.2f}s, {self.totals['api_calls']} API calls, {self.totals['throttled']} x 429, {self.totals['retries']} retries) ---")
+        print(f"  {'#':>3} {'action':<18} {'output':<18} {'wall (s)':>9} {'calls':>6} {'KB':>9} {'429':>4} {'retry':>5} {'peak MB':>8} {'in':>7} {'out':>7}")
+        for r in steps:
+            peak = f"{r['peak_mb']:>7.2f}{'*' if r['memory_shared'] else ' '}" if 'peak_mb' in r else f"{'-':>8}"
+            print(f"  {r['step']:>3} {r['action']:<18} {str(r['output'])[:18]:<18} {r['wall_s']:>9.3f} {r['api_calls']:>6} {r['bytes'] / 1024:>9.1f} "
+                  f"{r['throttled']:>4} {r['retries']:>5} {peak} {r['in']:>7} {r['out']:>7}")
+        if any(r.get('memory_shared') for r in steps): print("  (* step overlapped with others; peak memory is shared)")
+        for name, n in sorted(self.totals['endpoints'].items(), key=lambda x: -x[1])[:5]: print(f"  - {n:>6} x {name}")
+        print(f"  - Summary: {base}.json")
+        print(f"  - Trace:   {base}.trace.json (open in ui.perfetto.dev)")
+        return summary
+
+CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+def parse_cron(expr):
+    """'minute hour day month weekday' (*, lists, ranges, /steps; Sunday is 0 or 7) -> (allowed value sets, day_or)."""
+    parts = expr.split()
+    if len(parts) != 5: raise ValueError(f"Cron expression needs 5 fields: '{expr}'")
+    fields = []
+    for part, (lo, hi) in zip(parts, CRON_RANGES):
+        values = set()
+        for item in part.split(','):
+            rng, _, step = item.partition('/')
+            if rng == '*': start, end = lo, hi
+            elif '-' in rng: start, end = map(int, rng.split('-'))
+            else: start = end = int(rng); end = hi if step else end
+            if not lo <= start <= end <= hi: raise ValueError(f"Cron field out of range: '{item}'")
+            values.update(range(start, end + 1, int(step or 1)))
+        fields.append(values)
+    fields[4] = {v % 7 for v in fields[4]}
+    # As in cron: if both day fields are restricted, either one matching is enough
+    return fields, parts[2] != '*' and parts[4] != '*'
+
+def next_cron(spec, after):
+    """First minute after `after` matching a parse_cron() spec."""
+    (minutes, hours, days, months, weekdays), day_or = spec
+    t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = t + timedelta(days=366 * 5)
+    while t < limit:
+        dom, dow = t.day in days, (t.weekday() + 1) % 7 in weekdays
+        if t.month not in months or not ((dom or dow) if day_or else (dom and dow)):
+            t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+        elif t.hour not in hours: t = (t + timedelta(hours=1)).replace(minute=0)
+        elif t.minute not in minutes: t += timedelta(minutes=1)
+        else: return t
+    raise ValueError("Cron expression never matches.")
+
+class SharedResources:
+    """
+    State that the SpotifyMixer instances of one process share (daemon mode): the HTTP pool, rate limiters,
+    authenticated clients, metadata caches and recently fetched sources.
+    """
+    def __init__(self, dedup_window=600):
+        self.lock = threading.Lock()
+        self.objects = {}; self.sources = {}
+        self.dedup_window = dedup_window
+        self.dedup_hits = 0
+
+    def get(self, kind, key, create):
+        """The shared object of this kind and key, created by the first mixer asking for it."""
+        with self.lock:
+            store = self.objects.setdefault(kind, {})
+            if key not in store: store[key] = create()
+            return store[key]
+
+    def fetch_once(self, key, fetch):
+        """Result of `fetch()`, shared by every caller asking for the same source within the dedup window."""
+        with self.lock:
+            entry = self.sources.get(key)
+            now = time.time()
+            for k in [k for k, (t, f) in self.sources.items() if f.done() and now - t >= self.dedup_window]: del self.sources[k]
+            entry = self.sources.get(key); reuse = entry is not None
+            if reuse: self.dedup_hits += 1
+            else: entry = self.sources[key] = (time.time(), Future())
+        if reuse: return entry[1].result()
+        try: entry[1].set_result(fetch())
+        except Exception as e: entry[1].set_exception(e)
+        # Failed or empty fetches are not shared beyond the callers already waiting
+        if entry[1].exception() or not entry[1].result():
+            with self.lock:
+                if self.sources.get(key) is entry: del self.sources[key]
+        return entry[1].result()
+
+    def forget(self, playlist_id):
+        """Drops shared fetches of a playlist that a workflow has just modified."""
+        with self.lock:
+            for key in [k for k in self.sources if k[0] == playlist_id]: del self.sources[key]
 
 class SpotifyMixer:
-    def __init__(self, config_file):
+    def __init__(self, config_file, profile=None, shared=None, offline=None):
+        self.shared = shared  # SharedResources in daemon mode
         # Determine script location for relative paths
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
         self.load_config(config_file)
         self.memory = {} 
         self.spotify_features_disabled = False 
+        self.settings = self.config.get('settings', {})
+        if self.settings.get('data_dir'):
+            # Relative files (databases, caches, token) live here instead of next to the script
+            self.script_dir = os.path.abspath(os.path.join(self.script_dir, self.settings['data_dir']))
+        endpoints = self.settings.get('endpoints', {})
+        self.embed_url = endpoints.get('embed', "https://open.spotify.com/embed").rstrip('/')
+        self.reccobeats_url = endpoints.get('reccobeats', "https://api.reccobeats.com/v1").rstrip('/')
+        self.api_prefix = endpoints.get('spotify_api')
+        self.local_dbs = {}; self.db_lock = threading.Lock()
+        self.artist_genres = {}; self.genre_lock = threading.Lock()
+        self.streaming = bool(self.settings.get('streaming', False))
+        self.lazy_sources = []; self.single_readers = set()
+        fields = self.track_fields()
+        self.track_keep = None if fields is None else {re.split(r'[(.]', f)[0] for f in fields}
+        self.artist_pool = {}
+        self.fingerprints = {}
+        # Command line option (--offline) overrides settings.offline
+        self.offline = bool(self.settings.get('offline', False) if offline is None else offline)
+        self._clients = None; self.client_lock = threading.RLock()
+        network = self.settings.get('network', {})
+        self.concurrency = max(1, int(network.get('concurrency', 4)))
+        self.max_retries = int(network.get('max_retries', 5))
+        self.timeout = network.get('timeout')  # None keeps the per-request defaults
+        self.engine = 'threads' if self.offline else network.get('engine', 'threads')
+        scheduler = self.settings.get('scheduler', {})
+        workers = int(scheduler.get('workers', 4)) if scheduler.get('parallel', True) else 1
+        self.pool_size = int(network.get('pool_size', max(10, 2 * self.concurrency * workers)))
+        # Workflows of the same app share its Spotify quota
+        client_id = self.config.get('credentials', {}).get('client_id')
+        self.limiter = self._shared('limiter', client_id, lambda: RateLimiter(network.get('requests_per_second', 10)))
+        self.reccobeats_limiter = self._shared('limiter', 'reccobeats', lambda: RateLimiter(network.get('reccobeats_requests_per_second', 5)))
+        self.embed_limiter = self._shared('limiter', 'embed', lambda: RateLimiter(network.get('embed_requests_per_second', 5)))
+        # Command line options (see __main__) override settings.profile
+        profiling = {**self.settings.get('profile', {}), **(profile or {})}
+        self.profiler = None
+        if profiling.get('enabled', False) and not shared:
+            self.profiler = RunProfiler(self._local_path(profiling.get('dir', 'profiles')), memory=profiling.get('memory', True), cprofile_step=profiling.get('cprofile_step'))
+        # Offline sessions report blocked requests to their own mixer, so they are never shared
+        self.http = self.build_http_session() if self.offline else self._shared('http', None, self.build_http_session)
         
         print(f"--- Spotify Mixer Initialization ---")
         print(f"  - Working directory: {self.script_dir}")
-        self.sp_user = self.authenticate_user()
-        self.sp_public = self.authenticate_public()
-        print("  - Connected to Spotify API.")
+        if self.profiler: print(f"  - Profiling enabled (output: {self.profiler.out_dir})")
+        if self.offline: print("  - Offline mode: using local files and caches only.")
+        if shared and profiling.get('enabled', False): print("  ! WARNING: Profiling is not available in daemon mode (requests of all workflows share one pool).")
+        if self.engine == 'async' and import_aiohttp() is None: print("  ! WARNING: 'async' engine needs aiohttp (pip install aiohttp). Using threads.")
+        self.cache = self.open_cache()
+        memo = self.settings.get('memoize', {})
+        self.memoize = bool(memo.get('enabled', False)) and self.cache is not None
+        if memo.get('enabled', False) and not self.cache: print("  ! WARNING: 'memoize' needs the metadata cache. Steps are always recomputed.")
+
+    @property
+    def sp_user(self):
+        return self.clients()[0]
+
+    @property
+    def sp_public(self):
+        return self.clients()[1]
+
+    def clients(self):
+        """(user client, public client), created when a step first needs the API. Local-only workflows never log in."""
+        with self.client_lock:
+            if self._clients is None:
+                if self.offline: raise self._offline_blocked("the Spotify API")
+                import_spotipy()
+                self._clients = self._shared('clients', self.client_key(), lambda: (self.authenticate_user(), self.authenticate_public()))
+                print("  - Connected to Spotify API.")
+            return self._clients
+
+    def client_key(self):
+        # The token cache lives in the working directory, so clients are shared per app and directory
+        return (self.config.get('credentials', {}).get('client_id'), self.script_dir, self.api_prefix)
+
+    def _offline_blocked(self, what):
+        """Records that the running step needs the network in offline mode; the step fails when it returns."""
+        error = OfflineError(f"Offline mode: {what} is not available.")
+        blocked = blocked_requests.get()
+        if blocked is not None: blocked.append(error)
+        return error
+
+    def check_offline(self, steps):
+        """Fails before the first step if the workflow contains steps that always need the network."""
+        for i, step in enumerate(steps, 1):
+            action = step.get('action')
+            sources = [step.get('id', '')] if action == 'source' else [src for c in step.get('cases', []) for src in c.get('sources', [])] if action == 'season' else []
+            if action in ('save', 'sync_local_db') or any(str(src) == 'me' or str(src).startswith('top_tracks') for src in sources):
+                raise OfflineError(f"Offline mode: step {i} ({action} -> {step.get('output', 'temp')}) needs the Spotify API.")
+
+    def _shared(self, kind, key, create):
+        return self.shared.get(kind, key, create) if self.shared else create()
 
     def load_config(self, filename):
         if not os.path.isabs(filename):
@@ -29,22 +798,56 @@ class SpotifyMixer:
         with open(filename, 'r') as f:
             self.config = json.load(f)
 
+    def open_cache(self):
+        opts = self.settings.get('cache', {})
+        if not opts.get('enabled', True): return None
+        path = opts.get('path', '.mixer_cache.sqlite')
+        if not os.path.isabs(path): path = os.path.join(self.script_dir, path)
+        try:
+            def create():
+                cache = MetadataCache(path, max_entries=opts.get('max_entries', 50000))
+                cache.allow_stale = self.offline
+                return cache
+            # Offline jobs of a daemon get their own handle, as they read the same file with different expiry rules
+            cache = self._shared('cache', (path, self.offline), create)
+            print(f"  - Metadata cache: {path}")
+            return cache
+        except Exception as e:
+            print(f"  ! WARNING: Metadata cache unavailable ({e}). Continuing without it.")
+            return None
+
+    def build_http_session(self):
+        """One keep-alive connection pool shared by the Spotipy clients, their auth managers, the scraper and ReccoBeats."""
+        session = requests.Session()
+        # Server errors are retried here; 429 is left to _api()/_http_get() so RateLimiter sees Retry-After
+        retry = Retry(total=3, connect=None, read=False, status=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']), respect_retry_after_header=False, raise_on_status=False)
+        adapter = OfflineAdapter(self._offline_blocked) if self.offline else HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount('http://', adapter); session.mount('https://', adapter)
+        if self.profiler:
+            session.hooks['response'].append(self.profiler.record_response)
+            self.profiler.observe_retries(session)
+        return session
+
+    def _cache_ttl(self, key, default_hours):
+        return float(self.settings.get('cache', {}).get(key, default_hours)) * 3600
+
     def authenticate_user(self):
         creds = self.config['credentials']
-        os.chdir(self.script_dir)
         cache_path = os.path.join(self.script_dir, ".cache")
         
         if not os.access(self.script_dir, os.W_OK):
             print(f"  ! WARNING: No write permissions in {self.script_dir}. Credentials might not be cached.")
 
         # Included 'playlist-read-collaborative' to prevent 403 errors on owned collaborative playlists
-        auth_manager = SpotifyOAuth(
+        auth_manager = spotipy.oauth2.SpotifyOAuth(
             client_id=creds['client_id'],
             client_secret=creds['client_secret'],
             redirect_uri=creds['redirect_uri'],
             scope="playlist-modify-public playlist-modify-private playlist-read-private playlist-read-collaborative user-library-read user-top-read",
             cache_path=cache_path,
-            open_browser=False
+            open_browser=False,
+            requests_session=self.http
         )
 
         token_info = auth_manager.get_cached_token()
@@ -55,22 +858,170 @@ class SpotifyMixer:
             print("the redirect URL (containing 'code=...') below.")
             print("="*60 + "\n")
         
-        return spotipy.Spotify(auth_manager=auth_manager)
+        return self._configure_client(spotipy.Spotify(auth_manager=auth_manager, requests_session=self.http, requests_timeout=self.timeout or 5))
 
     def authenticate_public(self):
         creds = self.config['credentials']
-        return spotipy.Spotify(auth_manager=SpotifyClientCredentials(
+        return self._configure_client(spotipy.Spotify(auth_manager=spotipy.oauth2.SpotifyClientCredentials(
             client_id=creds['client_id'],
-            client_secret=creds['client_secret']
-        ))
+            client_secret=creds['client_secret'],
+            requests_session=self.http
+        ), requests_session=self.http, requests_timeout=self.timeout or 5))
+
+    def _configure_client(self, client):
+        if self.api_prefix: client.prefix = self.api_prefix.rstrip('/') + '/'
+        session = getattr(client, '_session', None)
+        if self.profiler and isinstance(session, requests.Session) and session is not self.http:
+            client._session.hooks['response'].append(self.profiler.record_response)
+            self.profiler.observe_retries(client._session)
+        return client
+
+    def _api(self, fn, *args, **kwargs):
+        """Calls a Spotipy method through the shared rate limiter, waiting out 429 responses."""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                res = fn(*args, **kwargs)
+                self.limiter.succeeded()
+                return res
+            except import_spotipy().SpotifyException as e:
+                if e.http_status != 429 or attempt == self.max_retries: raise
+                retry_after = float((e.headers or {}).get('Retry-After', 2 ** attempt))
+                print(f"      ! Rate limited (429). Backing off {retry_after:.0f}s...")
+                if self.profiler: self.profiler.record_retry()
+                self.limiter.throttled(retry_after)
+
+    def _parallel_map(self, fn, items):
+        """Maps fn over items on a bounded worker pool. Results keep the input order."""
+        items = list(items)
+        if self.concurrency <= 1 or len(items) <= 1: return [fn(x) for x in items]
+        ctx = contextvars.copy_context()  # Workers count towards the caller's step when profiling
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(items))) as pool:
+            return list(pool.map(lambda x: ctx.copy().run(fn, x), items))
+
+    def _fetch_pages(self, fetch, limit, track_of=None):
+        """
+        Loads a paged collection. `fetch(offset)` returns one page; the first page tells the total,
+        the remaining offsets are requested concurrently. Returns (items in order, complete).
+        With `track_of`, every page is converted as it arrives (items mapped to None are dropped).
+        """
+        convert = (lambda items: [t for t in map(track_of, items) if t]) if track_of else (lambda items: items)
+        first = self._api(fetch, 0)
+        step = len(first['items']) or limit
+        def page(offset):
+            try: return convert(self._api(fetch, offset)['items'])
+            except Exception as e:
+                print(f"    ! Pagination error (offset {offset}): {e}")
+                return None
+        pages = [convert(first['items'])] + self._parallel_map(page, range(step, first.get('total') or 0, step))
+        return [item for p in pages if p for item in p], all(p is not None for p in pages)
+
+    def track_fields(self):
+        """
+        Track fields the workflow reads, None for all of them.
+        settings.track_fields: "auto" (core fields plus `by` keys of sort steps), a list of extra fields, or "full".
+        """
+        setting = self.settings.get('track_fields', 'auto')
+        if setting == 'full': return None
+        fields = ['id', 'uri', 'name', 'artists(id,name)', 'external_ids', 'popularity']
+        if setting == 'auto':
+            fields += [step.get('by', 'popularity') for step in self.config.get('workflow', []) if step.get('action') in ('sort', 'weighted_shuffle')]
+        else:
+            fields += list(setting)
+        return list(dict.fromkeys(fields))
+
+    def playlist_fields(self):
+        """`fields` filter for playlist pages, so only track fields the workflow reads are downloaded."""
+        fields = self.track_fields()
+        if fields is None: return None
+        fields = [f for f in fields if re.split(r'[(.]', f)[0] in TRACK_FIELDS]
+        return f"items(track({','.join(fields)})),total"
+
+    def compact_tracks(self, tracks):
+        """Converts fetched tracks into Track records holding only track_fields (lazy sources already load them compact)."""
+        return tracks if isinstance(tracks, LazyTracks) else [self._compact_track(t) for t in tracks]
+
+    def _compact_track(self, t):
+        if t is None or isinstance(t, Track): return t
+        return Track(t, self.track_keep, self._intern_artist)
+
+    def _intern_artist(self, a):
+        # Every track of an artist shares one small dict instead of a full artist object
+        key = (a.get('id'), a.get('name'))
+        return self.artist_pool.get(key) or self.artist_pool.setdefault(key, {'id': key[0], 'name': key[1]})
+
+    def _clean_playlist_id(self, playlist_id):
+        raw_id = str(playlist_id).strip()
+        if raw_id.startswith('spotify:playlist:'): raw_id = raw_id.split(':')[-1]
+        elif "spotify.com" in raw_id: raw_id = raw_id.split("/")[-1].split("?")[0]
+        return raw_id
+
+    def _local_path(self, filename):
+        return filename if os.path.isabs(filename) else os.path.join(self.script_dir, filename)
+
+    def local_db(self, filename):
+        """Returns the (shared) LocalDatabase for a '.json' database filename."""
+        path = self._local_path(filename)
+        with self.db_lock:
+            # In daemon mode all jobs use one instance per file, so a legacy JSON file is migrated only once
+            if path not in self.local_dbs: self.local_dbs[path] = self._shared('local_db', path, lambda: LocalDatabase(path))
+            return self.local_dbs[path]
 
     def resolve_input(self, input_name):
         if isinstance(input_name, list):
             combined = []
             for name in input_name:
-                combined.extend(self.memory.get(name, []))
+                combined.extend(self._materialized(name))
             return combined
-        return self.memory.get(input_name, [])
+        return self._materialized(input_name)
+
+    def _materialized(self, name):
+        tracks = self.memory.get(name, [])
+        if isinstance(tracks, LazyTracks):
+            # Later readers share this list, as without streaming (e.g. save's in-place shuffle)
+            tracks = self.memory[name] = tracks.materialize()
+        return tracks
+
+    # --- STREAMING (settings.streaming) ---
+    def _input_stream(self, name):
+        """The step input as LazyTracks if it is one, otherwise as a list."""
+        if isinstance(name, str) and isinstance(self.memory.get(name), LazyTracks): return self.memory[name]
+        return self.resolve_input(name)
+
+    def _stream_output(self, step, result):
+        # Outputs read by exactly one later step don't need to keep their tracks
+        if isinstance(result, LazyTracks): result.buffer = step.get('output', 'temp') not in self.single_readers
+        return result
+
+    def _derive(self, step, inp, tracks):
+        """Lazy result for a lazy input, list otherwise."""
+        return self._stream_output(step, LazyTracks(tracks)) if isinstance(inp, LazyTracks) else list(tracks)
+
+    def _left(self, result):
+        return 'streaming' if isinstance(result, LazyTracks) else f"{len(result)} left"
+
+    def _settle_sources(self, playlist_id):
+        """Loads pending lazy sources of a playlist completely before the workflow modifies it."""
+        for pid, ref in self.lazy_sources:
+            stream = ref()
+            if pid == playlist_id and stream is not None and not stream.done and not stream.consumed:
+                stream.buffer = True
+                stream.materialize()
+
+    def _lazy_pages(self, fetch, limit, track_of, on_complete=None):
+        """Streaming counterpart of _fetch_pages(): loads the first page now (for the total), the rest when a consumer reaches it."""
+        first = self._api(fetch, 0)
+        size = len(first['items']) or limit; failed = []
+        def load_page(i):
+            try: items = first['items'] if i == 0 else self._api(fetch, i * size)['items']
+            except Exception as e:
+                print(f"    ! Pagination error (offset {i * size}): {e}")
+                failed.append(i); return []
+            return [track_of(item) for item in items]
+        def complete(tracks):
+            if on_complete and not failed: on_complete(tracks)
+        return LazyTracks(load_page=load_page, total=first.get('total') or 0, page_size=size,
+                          map_pages=self._parallel_map, prefetch=self.concurrency, on_complete=complete)
 
     # --- HYDRATE LOGIC ---
     def _should_hydrate(self, setting, is_scraper=False):
@@ -80,33 +1031,53 @@ class SpotifyMixer:
         if val == 'auto': return is_scraper 
         return False
 
-    def hydrate_tracks_smart(self, uris):
+    def _fetch_track_batch(self, batch_ids):
+        """Full track objects for up to 50 IDs as [(id, track)]."""
+        try:
+            res = self._api(self.sp_user.tracks, batch_ids, market="from_token")
+            # Results are positional, so relinked tracks stay keyed by the requested ID
+            return [(tid, t) for tid, t in zip(batch_ids, res['tracks']) if t and t.get('name')]
+        except Exception as e:
+            print(f"      ! Metadata fetch error: {str(e)[:100]}")
+            return []
+
+    def hydrate_tracks_smart(self, uris, keep_missing=False):
         if not uris: return []
-        temp_tracks = []
-        for i in range(0, len(uris), 50):
-            batch = uris[i:i+50]
-            batch_ids = [u.split(':')[-1] for u in batch]
-            try:
-                res = self.sp_user.tracks(batch_ids, market="from_token")
-                for t in res['tracks']:
-                    if t and t.get('name'): temp_tracks.append(t)
-            except Exception as e:
-                print(f"      ! Metadata fetch error: {str(e)[:100]}")
-            
-        print(f"      -> Metadata fetched for {len(temp_tracks)} tracks. Refining via search...")
+        ids = [u.split(':')[-1] for u in uris]
+        # Cached entries hold the hydrated track and its search-refined replacement
+        cached = self.cache.get_many('tracks', ids) if self.cache else {}
+        missing = [tid for tid in dict.fromkeys(ids) if tid not in cached]
+        if self.cache: print(f"      -> Metadata cache: {len(cached)} hits, {len(missing)} misses.")
+
+        fetched = {}
+        if missing:
+            def refine(item):
+                tid, t = item
+                query = f"track:{t['name']} artist:{t['artists'][0]['name']}"
+                try:
+                    search_res = self._api(self.sp_user.search, q=query, type='track', limit=1)
+                    if search_res['tracks']['items']:
+                        found_track = search_res['tracks']['items'][0]
+                        if 'external_ids' in t and 'external_ids' not in found_track:
+                            found_track['external_ids'] = t['external_ids']
+                        return tid, {'track': t, 'refined': found_track}, True
+                except: return tid, {'track': t, 'refined': None}, False
+                return tid, {'track': t, 'refined': None}, True
+
+            batches = [missing[i:i+50] for i in range(0, len(missing), 50)]
+            temp_tracks = [item for batch in self._parallel_map(self._fetch_track_batch, batches) for item in batch]
+            print(f"      -> Metadata fetched for {len(temp_tracks)} tracks. Refining via search...")
+            results = self._parallel_map(refine, temp_tracks)
+            fetched = {tid: entry for tid, entry, _ in results}
+            if not all(answered for _, _, answered in results): lookup_failed('track search')
+            # Only answered searches are cached; a failed one (timeout, 429 after max_retries) is retried next run
+            if self.cache: self.cache.put_many('tracks', {tid: entry for tid, entry, answered in results if answered}, self._cache_ttl('track_ttl_hours', 24 * 30))
+
         valid_tracks = []
-        for idx, t in enumerate(temp_tracks):
-            query = f"track:{t['name']} artist:{t['artists'][0]['name']}"
-            try:
-                search_res = self.sp_user.search(q=query, type='track', limit=1)
-                if search_res['tracks']['items']:
-                    found_track = search_res['tracks']['items'][0]
-                    if 'external_ids' in t and 'external_ids' not in found_track:
-                        found_track['external_ids'] = t['external_ids']
-                    valid_tracks.append(found_track)
-                else: valid_tracks.append(t)
-            except: valid_tracks.append(t)
-            if (idx + 1) % 50 == 0: time.sleep(0.05)
+        for tid in ids:
+            entry = cached.get(tid) or fetched.get(tid)
+            if entry: valid_tracks.append(entry['refined'] or entry['track'])
+            elif keep_missing: valid_tracks.append(None)
         return valid_tracks
 
     def get_tracks_from_file(self, filename, hydrate='auto'):
@@ -114,12 +1085,10 @@ class SpotifyMixer:
         try:
             file_path = filename if os.path.isabs(filename) else os.path.join(self.script_dir, filename)
             if file_path.endswith('.json'):
-                if os.path.exists(file_path):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        tracks = data.get('tracks', [])
-                        print(f"    > Local Database '{filename}': Loaded {len(tracks)} items.")
-                        return tracks
+                if os.path.exists(file_path) or os.path.exists(os.path.splitext(file_path)[0] + '.sqlite'):
+                    tracks = self.local_db(file_path).all()
+                    print(f"    > Local Database '{filename}': Loaded {len(tracks)} items.")
+                    return tracks
                 else:
                     return []
 
@@ -136,37 +1105,120 @@ class SpotifyMixer:
         except Exception as e: print(f"    ! File read error: {e}")
         return tracks
 
-    def scrape_playlist_tracks(self, playlist_id, hydrate='auto'):
-        url = f"https://open.spotify.com/embed/playlist/{playlist_id}"
+    def scrape_playlist_tracks(self, playlist_id, hydrate='auto', lazy=False):
+        url = f"{self.embed_url}/playlist/{playlist_id}"
         print(f"    > Scraper Fallback: Deep-scan on Embed page ({url})...")
+        # 'full': search-refined hydration (hydrate "true"); 'fields': only what the workflow reads (default); None: page data only
+        mode = 'full' if str(hydrate).lower() == 'true' else 'fields' if self._should_hydrate(hydrate, is_scraper=True) else None
+        if mode == 'fields' and not self.scrape_missing_fields(): mode = None
+        cache_key = f"embed:{playlist_id}"
+        cached = self.cache.get_many('sources', [cache_key]).get(cache_key) if self.cache else None
+        if cached and cached.get('version') != EMBED_VERSION: cached = None
+        if self.offline and cached and cached.get('tracks') is not None and cached['hydrated'] == mode and cached.get('fields') == self.playlist_fields():
+            print(f"      -> Offline: using {len(cached['tracks'])} cached tracks.")
+            return cached['tracks']
         try:
             headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36'}
-            response = requests.get(url, headers=headers, timeout=15)
-            if response.status_code == 200:
-                html = response.text
-                ids = re.findall(r'spotify:track:([a-zA-Z0-9]{22})', html)
-                ids = list(dict.fromkeys(ids))
-                if ids:
-                    print(f"      -> FOUND! {len(ids)} track IDs via Scraper.")
-                    uris = [f"spotify:track:{tid}" for tid in ids]
-                    if self._should_hydrate(hydrate, is_scraper=True):
-                        return self.hydrate_tracks_smart(uris)
-                    else:
-                        return [{'uri': u, 'id': u.split(':')[-1]} for u in uris]
-            else: print(f"      ! Scraper could not load page (Status: {response.status_code})")
+            # Conditional request: an unchanged page may be answered with 304 and no body
+            if cached and cached.get('partials'):
+                if cached.get('etag'): headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'): headers['If-Modified-Since'] = cached['last_modified']
+            response = self._http_get(url, self.embed_limiter, headers=headers, timeout=self.timeout or 15)
+            if response.status_code == 304 and cached:
+                print("      -> Embed page not modified since last run.")
+                partials = cached['partials']
+            elif response.status_code == 200:
+                partials = parse_embed_tracks(response.text)
+            else:
+                print(f"      ! Scraper could not load page (Status: {response.status_code})")
+                return []
+            if partials:
+                ids = [t['id'] for t in partials]
+                print(f"      -> FOUND! {len(ids)} tracks via Scraper.")
+                if cached and cached['ids'] == ids and cached['hydrated'] == mode and cached.get('tracks') is not None and cached.get('fields') == self.playlist_fields():
+                    print(f"      -> Track list unchanged. Using {len(cached['tracks'])} cached tracks.")
+                    return cached['tracks']
+                def store(tracks):
+                    if not self.cache: return
+                    validators = cached if response.status_code == 304 else {}
+                    # A partially failed hydration is not reused; the next run retries the missing tracks
+                    complete = len(tracks) == len(ids) and not failed_lookups.get()
+                    self.cache.put_many('sources', {cache_key: {
+                        'etag': response.headers.get('ETag') or validators.get('etag'),
+                        'last_modified': response.headers.get('Last-Modified') or validators.get('last_modified'),
+                        'version': EMBED_VERSION, 'ids': ids, 'partials': partials, 'hydrated': mode, 'fields': self.playlist_fields(),
+                        'tracks': tracks if complete else None}},
+                        self._cache_ttl('source_ttl_hours', 24 * 7))
+                uris = [t['uri'] for t in partials]
+                if mode == 'fields': print(f"      -> Fetching missing fields ({', '.join(sorted(self.scrape_missing_fields()))}).")
+                if mode and lazy:
+                    # Hydrated in batches of 50 when consumers reach them
+                    load = (lambda i: self.hydrate_tracks_smart(uris[i * 50:(i + 1) * 50], keep_missing=True)) if mode == 'full' else (lambda i: self.fill_tracks(partials[i * 50:(i + 1) * 50]))
+                    return LazyTracks(load_page=lambda i: self.compact_tracks(load(i)), total=len(uris),
+                                      page_size=50, map_pages=self._parallel_map, prefetch=self.concurrency, on_complete=store)
+                if mode == 'full': tracks = self.hydrate_tracks_smart(uris)
+                elif mode == 'fields': tracks = self.fill_tracks(partials)
+                else: tracks = partials
+                store(tracks)
+                return tracks
         except Exception as e: print(f"      ! Scraper error: {e}")
         return []
 
-    def get_tracks(self, playlist_id, playlist_name=None, hydrate='auto'):
+    def scrape_missing_fields(self):
+        """Track fields the workflow reads that embed pages do not contain (artist IDs, popularity, ...)."""
+        steps = self.config.get('workflow', [])
+        actions = {step.get('action') for step in steps}
+        missing = set()
+        # Embed pages have no artist records
+        if actions & {'artist_separation', 'filter_artist', 'filter_genre', 'sync_local_db'}: missing.add('artists')
+        fields = self.track_fields()
+        if fields is None: return {'full'}
+        wanted = {step.get('by', 'popularity') for step in steps if step.get('action') in ('sort', 'weighted_shuffle')}
+        if self.settings.get('track_fields', 'auto') != 'auto': wanted.update(re.split(r'[(.]', f)[0] for f in self.settings['track_fields'])
+        return missing | ((wanted & TRACK_FIELDS) - EMBED_FIELDS)
+
+    def fill_tracks(self, partials):
+        """
+        Completes scraped track records with one `tracks` request per 50 IDs (no search refinement),
+        reusing cached metadata. Tracks that cannot be fetched keep their partial record.
+        Fetched tracks are cached under 'track_data', as 'tracks' entries also hold a search refinement.
+        """
+        ids = [t['id'] for t in partials]
+        full = {}
+        if self.cache:
+            full = {tid: entry['track'] for tid, entry in self.cache.get_many('tracks', ids).items()}
+            full.update(self.cache.get_many('track_data', [tid for tid in ids if tid not in full]))
+        missing = [tid for tid in dict.fromkeys(ids) if tid not in full]
+        batches = [missing[i:i+50] for i in range(0, len(missing), 50)]
+        fetched = {}
+        for batch in self._parallel_map(self._fetch_track_batch, batches): fetched.update(batch)
+        if self.cache: self.cache.put_many('track_data', fetched, self._cache_ttl('track_ttl_hours', 24 * 30))
+        full.update(fetched)
+        return [{**t, **full.get(t['id'], {})} for t in partials]
+
+    def fetch_source(self, playlist_id, playlist_name=None, hydrate='auto', lazy=False):
+        """Compact tracks of a source. In daemon mode, workflows asking for the same source within the dedup window share one fetch."""
+        fetch = lambda: self.compact_tracks(self.get_tracks(playlist_id, playlist_name, hydrate=hydrate, lazy=lazy))
+        if not self.shared or lazy: return fetch()
+        path = playlist_id if os.path.isabs(playlist_id) else os.path.join(self.script_dir, playlist_id)
+        local = os.path.isfile(path)
+        # Playlists are shared per login (without logging in here); offline jobs only share with each other.
+        # Scraped tracks also depend on the fields this workflow needs (scrape_missing_fields)
+        remote = None if local else (self.client_key(), self.offline, tuple(sorted(self.scrape_missing_fields())))
+        key = (path if local else self._clean_playlist_id(playlist_id), hydrate, self.playlist_fields(), remote)
+        # Copies of the list and its tracks, so in-place changes (save's shuffle, filter_audio's bpm/energy) stay within this workflow
+        return [t.copy() if isinstance(t, Track) else dict(t) for t in self.shared.fetch_once(key, fetch)]
+
+    def get_tracks(self, playlist_id, playlist_name=None, hydrate='auto', lazy=False):
+        """Tracks of a playlist, 'me', 'top_tracks_*' or local file. With `lazy`, API and scraper sources return LazyTracks."""
         # 1. Check if ID is an existing local file (skip API/scraper if it is)
         file_path = playlist_id if os.path.isabs(playlist_id) else os.path.join(self.script_dir, playlist_id)
-        if os.path.exists(file_path) and os.path.isfile(file_path):
+        migrated_db = file_path.endswith('.json') and os.path.isfile(os.path.splitext(file_path)[0] + '.sqlite')
+        if (os.path.exists(file_path) and os.path.isfile(file_path)) or migrated_db:
             return self.get_tracks_from_file(playlist_id, hydrate=hydrate)
 
         # 2. Clean IDs and URLs strictly
-        raw_id = str(playlist_id).strip()
-        if raw_id.startswith('spotify:playlist:'): raw_id = raw_id.split(':')[-1]
-        elif "spotify.com" in raw_id: raw_id = raw_id.split("/")[-1].split("?")[0]
+        raw_id = self._clean_playlist_id(playlist_id)
         
         tracks = []
         should_hydrate = self._should_hydrate(hydrate, is_scraper=False)
@@ -181,72 +1233,81 @@ class SpotifyMixer:
                 return results['items']
 
             if raw_id == 'me':
-                results = self.sp_user.current_user_saved_tracks(limit=50, market="from_token")
-                while results:
-                    for item in results['items']: tracks.append(item['track'])
-                    if results['next']: results = self.sp_user.next(results)
-                    else: break
-                return tracks
+                # This endpoint has no `fields` filter, but its pages can be loaded concurrently
+                print("    > Fetching Liked Songs...")
+                fetch = lambda offset: self.sp_user.current_user_saved_tracks(limit=50, offset=offset, market="from_token")
+                # Full track objects are compacted page by page, so they never pile up
+                track_of = lambda item: self._compact_track(item['track']) if item and item.get('track') else None
+                if lazy: return self._lazy_pages(fetch, 50, track_of)
+                return self._fetch_pages(fetch, 50, track_of)[0]
             
             # --- API FETCH (Standard Official Spotipy Method) ---
             if len(raw_id) == 22:
+                fields = self.playlist_fields()
+                cached, snapshot = None, None
+                if self.cache: cached = self.cache.get_many('sources', [raw_id]).get(raw_id)
+                if self.offline:
+                    # No snapshot check: any cached copy is used, then the scraper's cached copy
+                    if cached and cached.get('fields') == fields:
+                        print(f"    > Offline: using {len(cached['tracks'])} cached tracks (ID: {raw_id}).")
+                        return cached['tracks']
+                    return self.scrape_playlist_tracks(raw_id, hydrate=hydrate, lazy=lazy)
+                # One cheap metadata request decides whether the cached copy is still current
+                if self.cache:
+                    try: snapshot = self._api(self.sp_user.playlist, raw_id, fields='snapshot_id')['snapshot_id']
+                    except Exception: pass
+                    if cached and snapshot and cached['snapshot_id'] == snapshot and cached.get('fields') == fields:
+                        print(f"    > Playlist unchanged since last run (ID: {raw_id}). Using {len(cached['tracks'])} cached tracks.")
+                        return cached['tracks']
+
                 print(f"    > Fetching items via API (ID: {raw_id})...")
-                results = None
+                items = None
+                fetch = lambda offset: self.sp_user.playlist_items(raw_id, fields=fields, limit=100, offset=offset, market="from_token")
+                track_of = lambda item: self._compact_track(item['track']) if item and item.get('track') and item['track'].get('id') else None
+                def store(tracks):
+                    if snapshot: self.cache.put_many('sources', {raw_id: {'snapshot_id': snapshot, 'fields': fields, 'tracks': tracks}}, self._cache_ttl('source_ttl_hours', 24 * 7))
                 try:
-                    results = self.sp_user.playlist_items(raw_id, market="from_token")
+                    if lazy:
+                        stream = self._lazy_pages(fetch, 100, track_of, on_complete=store)
+                        if stream.total:
+                            # Weak, so released outputs are not kept alive
+                            self.lazy_sources.append((raw_id, weakref.ref(stream)))
+                            return stream
+                        items = []
+                    else:
+                        items, complete = self._fetch_pages(fetch, 100, track_of)
                 except Exception as e1:
                     print(f"    ! API fetch failed: {e1}")
                     if "403" in str(e1):
                         print("    ! 403 Forbidden: Missing scopes, user mismatch, or Premium required.")
                 
-                if results:
-                    while results:
-                        for item in results.get('items', []):
-                            if item and item.get('track') and item['track'].get('id'):
-                                tracks.append(item['track'])
-                        if results.get('next'):
-                            try:
-                                results = self.sp_user.next(results)
-                            except Exception as e_next:
-                                print(f"    ! Pagination error: {e_next}")
-                                break
-                        else: 
-                            break
+                if items is not None:
+                    tracks = items
                     if tracks: 
+                        if complete: store(tracks)
                         return tracks
                     else:
                         print("    ! API connected successfully, but returned 0 tracks.")
 
             # --- FALLBACK: SCRAPER ---
             if len(raw_id) == 22:
-                return self.scrape_playlist_tracks(raw_id, hydrate=hydrate)
+                return self.scrape_playlist_tracks(raw_id, hydrate=hydrate, lazy=lazy)
 
         except Exception as e: print(f"    ! Unexpected error in get_tracks: {e}")
         return []
 
     def sync_local_db(self, playlist_id, db_filename, mode='append', store_type='tracks', clear_source=False):
-        if not os.path.isabs(db_filename): db_path = os.path.join(self.script_dir, db_filename)
-        else: db_path = db_filename
+        db = self.local_db(db_filename)
         
         # Clean ID for the clear_source action later
-        raw_id = str(playlist_id).strip()
-        if raw_id.startswith('spotify:playlist:'): raw_id = raw_id.split(':')[-1]
-        elif "spotify.com" in raw_id: raw_id = raw_id.split("/")[-1].split("?")[0]
-
-        # Load current database
-        current_db = {'tracks': []}
-        if os.path.exists(db_path):
-            try:
-                with open(db_path, 'r', encoding='utf-8') as f: current_db = json.load(f)
-            except: pass
-        db_list = current_db.get('tracks', [])
+        raw_id = self._clean_playlist_id(playlist_id)
 
         # Fetch new items from Spotify
         spotify_items = self.get_tracks(playlist_id, hydrate=True)
         
         if not spotify_items:
             print("    > Source playlist is currently empty or unreadable. No new items to sync.")
-            return db_list # Always return existing DB
+            return db.all() # Always return existing DB
 
         input_ids = set()
         for t in spotify_items:
@@ -256,230 +1317,609 @@ class SpotifyMixer:
 
         count = 0
         if mode == 'append':
-            existing_ids = {item['id'] for item in db_list}
+            entries = []
             for t in spotify_items:
-                if store_type == 'tracks' and t['id'] not in existing_ids:
-                    entry = {'id': t['id'], 'uri': t['uri'], 'name': t['name'], 'artists': [{'name': a['name'], 'id': a['id']} for a in t.get('artists', [])]}
-                    db_list.append(entry); existing_ids.add(t['id']); count += 1
+                if store_type == 'tracks':
+                    entries.append({'id': t['id'], 'uri': t['uri'], 'name': t['name'], 'artists': [{'name': a['name'], 'id': a['id']} for a in t.get('artists', [])]})
                 elif store_type == 'artists':
                     for a in t.get('artists', []):
-                        if a['id'] not in existing_ids:
-                            entry = {'id': a['id'], 'name': a['name'], 'artists': [{'id': a['id']}]}
-                            db_list.append(entry); existing_ids.add(a['id']); count += 1
+                        entries.append({'id': a['id'], 'name': a['name'], 'artists': [{'id': a['id']}]})
+            count = db.add(entries)
             print(f"    > Added {count} new items to local database.")
 
         elif mode == 'remove':
-            orig_len = len(db_list)
-            db_list = [item for item in db_list if item['id'] not in input_ids]
-            count = orig_len - len(db_list)
+            count = db.remove(input_ids)
             print(f"    > Removed {count} items from local database.")
-
-        if count > 0:
-            current_db['tracks'] = db_list
-            with open(db_path, 'w', encoding='utf-8') as f: json.dump(current_db, f, indent=2)
         
         if clear_source and len(spotify_items) > 0 and len(raw_id) == 22:
+            if self.streaming: self._settle_sources(raw_id)
             try: 
                 # Use official Spotipy method to clear playlist (replace with empty list)
                 self.sp_user.playlist_replace_items(raw_id, [])
                 print(f"    > Source playlist on Spotify has been cleared.")
             except Exception as e: print(f"    ! Could not clear playlist: {e}")
+            if self.shared: self.shared.forget(raw_id)
             
-        return db_list
+        return db.all()
+
+    def get_artist_genres(self, artist_ids):
+        """Returns {artist_id: [lowercase genres]}. Each artist is requested at most once per run, and cached across runs."""
+        with self.genre_lock:
+            missing = [a for a in dict.fromkeys(artist_ids) if a not in self.artist_genres]
+            if missing and self.cache:
+                self.artist_genres.update(self.cache.get_many('artist_genres', missing))
+                missing = [a for a in missing if a not in self.artist_genres]
+            if missing:
+                print(f"    > Fetching genres for {len(missing)} artists...")
+                def fetch(batch):
+                    try: return {a['id']: [x.lower() for x in a['genres']] for a in self._api(self.sp_user.artists, batch)['artists'] if a}
+                    except: return {}
+                fetched = {}
+                for part in self._parallel_map(fetch, [missing[i:i+50] for i in range(0, len(missing), 50)]): fetched.update(part)
+                self.artist_genres.update(fetched)
+                if self.cache: self.cache.put_many('artist_genres', fetched, self._cache_ttl('artist_ttl_hours', 24 * 7))
+                if len(fetched) < len(missing): lookup_failed('artist genres')
+            return {a: self.artist_genres[a] for a in artist_ids if a in self.artist_genres}
+
+    def _http_get(self, url, limiter, **kwargs):
+        """GET through a RateLimiter. Like _api(), 429 responses are waited out and retried."""
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire()
+            resp = self.http.get(url, **kwargs)
+            if self._final_response(resp, limiter, attempt): return resp
+
+    def _final_response(self, resp, limiter, attempt):
+        """False if the request should be retried: on 429 all workers pause for Retry-After."""
+        if resp.status_code != 429 or attempt == self.max_retries:
+            if resp.status_code < 400: limiter.succeeded()
+            return True
+        retry_after = float(resp.headers.get('Retry-After', 2 ** attempt))
+        print(f"      ! Rate limited (429). Backing off {retry_after:.0f}s...")
+        if self.profiler: self.profiler.record_retry()
+        limiter.throttled(retry_after)
+        return False
+
+    def _http_get_many(self, urls, limiter, timeout=None):
+        """GETs independent URLs concurrently (settings.network.engine). Returns responses in order, None for failed requests."""
+        if self.engine == 'async' and aiohttp is not None and len(urls) > 1:
+            return asyncio.run(self._aio_get_many(urls, limiter, timeout))
+        def get(url):
+            try: return self._http_get(url, limiter, timeout=timeout)
+            except requests.RequestException: return None
+        return self._parallel_map(get, urls)
+
+    async def _aio_get_many(self, urls, limiter, timeout):
+        # All requests share one aiohttp connection pool; in-flight requests are bounded like the thread pool
+        slots = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        async with aiohttp.ClientSession(connector=connector, headers=dict(self.http.headers), timeout=aiohttp.ClientTimeout(total=timeout)) as client:
+            async def get(url):
+                async with slots:
+                    for attempt in range(self.max_retries + 1):
+                        await asyncio.to_thread(limiter.acquire)
+                        start = time.perf_counter()
+                        try:
+                            async with client.get(url) as r:
+                                resp = as_response(url, r.status, r.headers, await r.read(), time.perf_counter() - start)
+                        except (aiohttp.ClientError, asyncio.TimeoutError): return None
+                        requests.hooks.dispatch_hook('response', self.http.hooks, resp)
+                        if self._final_response(resp, limiter, attempt): return resp
+            return await asyncio.gather(*(get(url) for url in urls))
 
     def get_audio_features_reccobeats(self, track_ids):
-        base_url = "https://api.reccobeats.com/v1/track" 
-        results = []
-        for i in range(0, len(track_ids), 30):
+        """Returns (features, failed_ids). Batches run concurrently; the limiter only slows down on 429."""
+        base_url = f"{self.reccobeats_url}/track"
+        batches = [track_ids[i:i+30] for i in range(0, len(track_ids), 30)]
+        responses = self._http_get_many([f"{base_url}?ids={','.join(batch)}" for batch in batches], self.reccobeats_limiter, timeout=self.timeout or 10)
+        results, failed = [], []
+        for batch, resp in zip(batches, responses):
             try:
-                resp = requests.get(f"{base_url}?ids={','.join(track_ids[i:i+30])}", timeout=10)
-                if resp.status_code == 200: results.extend(resp.json().get('content', []))
+                if resp is not None and resp.status_code == 200:
+                    results.extend(resp.json().get('content', [])); continue
             except: pass
-            time.sleep(1.0) 
-        return results
+            failed.extend(batch)
+        return results, failed
+
+    def get_audio_features(self, tracks):
+        """
+        Returns one feature record ({'id', 'isrc', 'tempo', 'energy'}) per known track.
+        Lookup order: feature store (by track ID, then ISRC) -> ReccoBeats -> Spotify API.
+        Tracks that neither provider knows are remembered, so they are not asked for again.
+        """
+        isrc_of = {t['id']: t['external_ids']['isrc'] for t in tracks if t.get('id') and t.get('external_ids', {}).get('isrc')}
+        ids = list(dict.fromkeys(t['id'] for t in tracks if t.get('id')))
+        found, unknown, store = {}, set(), {}
+
+        if self.cache:
+            # Every track is looked up under two keys, but counts as one hit or miss
+            hits = self.cache.get_many('audio_features', [f"id:{tid}" for tid in ids] + [f"isrc:{i}" for i in set(isrc_of.values())], count=False)
+            for tid in ids:
+                by_id, by_isrc = hits.get(f"id:{tid}"), hits.get(f"isrc:{isrc_of.get(tid)}")
+                if by_id and not by_id.get('missing'): found[tid] = by_id
+                elif by_isrc and not by_isrc.get('missing'): found[tid] = by_isrc
+                elif by_id: unknown.add(tid)
+            self.cache.record('audio_features', len(found) + len(unknown), len(ids) - len(found) - len(unknown))
+            print(f"    > Feature store: {len(found)} known, {len(unknown)} known-missing, {len(ids) - len(found) - len(unknown)} to fetch.")
+
+        pending = [tid for tid in ids if tid not in found and tid not in unknown]
+        failed = set()
+        if pending:
+            content, recco_failed = self.get_audio_features_reccobeats(pending)
+            failed.update(recco_failed)
+            by_isrc, by_id = {}, {}
+            for f in content:
+                try: rec = {'tempo': float(f.get('tempo', 0)), 'energy': float(f.get('energy', 0))}
+                except (TypeError, ValueError): continue
+                if f.get('isrc'): by_isrc[f['isrc']] = rec; store[f"isrc:{f['isrc']}"] = rec
+                if 'href' in f:
+                    sid = f['href'].split('track/')[-1].split('?')[0]
+                    by_id[sid] = rec; store[f"id:{sid}"] = rec
+            for tid in pending:
+                rec = by_isrc.get(isrc_of.get(tid)) or by_id.get(tid)
+                if rec: found[tid] = rec
+
+        remaining = [tid for tid in pending if tid not in found]
+        # Spotify was not asked, so these tracks are not known to be missing
+        if remaining and self.spotify_features_disabled: failed.update(remaining)
+        elif remaining:
+            print(f"    > {len(remaining)} via Spotify API...")
+            for i in range(0, len(remaining), 100):
+                batch = remaining[i:i+100]
+                if self.spotify_features_disabled:
+                    failed.update(batch); continue
+                try:
+                    for tid, f in zip(batch, self._api(self.sp_user.audio_features, batch)):
+                        if f:
+                            rec = {'tempo': f['tempo'], 'energy': f['energy']}
+                            found[tid] = rec; store[f"id:{tid}"] = rec
+                except Exception as e:
+                    failed.update(batch)
+                    if "403" in str(e):
+                        self.spotify_features_disabled = True
+                        print("    ! Spotify Audio Features API 403. Disabled.")
+
+        if failed - found.keys(): lookup_failed('audio features')
+        if self.cache:
+            self.cache.put_many('audio_features', store, self._cache_ttl('feature_ttl_hours', 24 * 365))
+            # Negative entries: both providers answered, but neither knows the track
+            missing = {f"id:{tid}": {'missing': True} for tid in remaining if tid not in found and tid not in failed}
+            self.cache.put_many('audio_features', missing, self._cache_ttl('feature_miss_ttl_hours', 24 * 7))
+
+        return [{'id': tid, 'isrc': isrc_of.get(tid), 'tempo': found[tid]['tempo'], 'energy': found[tid]['energy']} for tid in ids if tid in found]
 
     def _apply_audio_features(self, tracks, features_list, min_bpm, max_bpm, min_energy, max_energy):
-        valid_tracks = []; isrc_map = {}
+        # Index tracks once; features match by ISRC first, then by track ID
+        isrc_map, id_map = {}, {}
         for t in tracks:
             if t.get('external_ids', {}).get('isrc'):
                 isrc_map.setdefault(t['external_ids']['isrc'], []).append(t)
+            if 'id' in t: id_map.setdefault(t['id'], []).append(t)
+
+        matches, bpms, energies = [], [], []
         for f in features_list:
             targets = []
             if f.get('isrc') in isrc_map: targets = isrc_map[f['isrc']]
-            elif 'href' in f: 
-                 try:
-                     sid = f['href'].split('track/')[-1].split('?')[0]
-                     targets = [t for t in tracks if t['id'] == sid]
+            elif f.get('id') or 'href' in f:
+                 try: targets = id_map.get(f.get('id') or f['href'].split('track/')[-1].split('?')[0], [])
                  except: pass
+            if not targets: continue
+            try: bpm, energy = float(f.get('tempo', 0)), float(f.get('energy', 0))
+            except (TypeError, ValueError): continue
             for t in targets:
-                try:
-                    bpm, energy = float(f.get('tempo', 0)), float(f.get('energy', 0))
-                    t['_audio_found'] = True
-                    if (min_bpm <= bpm <= max_bpm) and (min_energy <= energy <= max_energy):
-                        t['bpm'], t['energy'] = bpm, energy
-                        if t not in valid_tracks: valid_tracks.append(t)
-                except: pass
+                t['_audio_found'] = True
+                matches.append(t); bpms.append(bpm); energies.append(energy)
+
+        valid_tracks = []; seen = set()
+        in_range = zip(range_mask(bpms, min_bpm, max_bpm), range_mask(energies, min_energy, max_energy))
+        for t, bpm, energy, (bpm_ok, energy_ok) in zip(matches, bpms, energies, in_range):
+            if bpm_ok and energy_ok:
+                t['bpm'], t['energy'] = bpm, energy
+                if id(t) not in seen: seen.add(id(t)); valid_tracks.append(t)
         return valid_tracks
 
+    def separate_artists(self, tracks, min_distance, rng=random):
+        """
+        Shuffles tracks so that no artist repeats within `min_distance` positions.
+        A track that would clash is deferred, and the oldest deferred track is retried after every placement.
+        Tracks that never fit are appended at the end. Runs in linear time.
+        """
+        pool = tracks[:]; rng.shuffle(pool)
+        pool, postponed = deque(pool), deque()
+        result = []; last_pos = {}
+        while pool:
+            t = pool.popleft(); a_ids = [a['id'] for a in t.get('artists', [])]
+            # Same window as result[-min_distance:] (a non-positive distance slices from the start)
+            window_start = len(result) - min_distance if min_distance > 0 else -min_distance
+            if any(a in last_pos and last_pos[a] >= window_start for a in a_ids): postponed.append(t)
+            else:
+                for a in a_ids: last_pos[a] = len(result)
+                result.append(t)
+                if postponed: pool.appendleft(postponed.popleft())
+        result.extend(postponed)
+        return result
+
+    def save_playlist_diff(self, target_id, uris):
+        """
+        Edits the playlist into `uris` with removals, moves and inserts instead of wiping it.
+        Moves are only issued for tracks outside the longest run that is already in order.
+        Returns the number of write calls made, or None if a full rewrite is needed or cheaper.
+        """
+        snapshot = self._api(self.sp_user.playlist, target_id, fields='snapshot_id')['snapshot_id']
+        current = []
+        page = self._api(self.sp_user.playlist_items, target_id, fields='items(track(uri)),next', limit=100)
+        while page:
+            current.extend((item.get('track') or {}).get('uri') for item in page['items'])
+            page = self._api(self.sp_user.next, page) if page.get('next') else None
+
+        # Duplicates and local/unavailable items can't be addressed by URI alone
+        if len(set(current)) != len(current) or len(set(uris)) != len(uris) or not all(u and u.startswith('spotify:track:') for u in current):
+            print("    > Playlist contains duplicates or local items. Using full rewrite.")
+            return None
+
+        target_set, current_set = set(uris), set(current)
+        removals = [u for u in current if u not in target_set]
+        working = [u for u in current if u in target_set]
+        kept_order = [u for u in uris if u in current_set]
+        rank = {u: i for i, u in enumerate(kept_order)}
+        in_place = {working[i] for i in longest_increasing_subsequence([rank[u] for u in working])}
+        moves = [u for u in kept_order if u not in in_place]
+        add_runs = []
+        for i, u in enumerate(uris):
+            if u in current_set: continue
+            if add_runs and add_runs[-1][0] + len(add_runs[-1][1]) == i: add_runs[-1][1].append(u)
+            else: add_runs.append((i, [u]))
+
+        full_cost = 1 + (len(uris) + 99) // 100
+        cost = (len(removals) + 99) // 100 + len(moves) + sum((len(run) + 99) // 100 for _, run in add_runs)
+        if cost >= full_cost:
+            print(f"    > Diff needs {cost} write calls (full rewrite: {full_cost}). Using full rewrite.")
+            return None
+
+        calls = 0
+        for i in range(0, len(removals), 100):
+            snapshot = self._api(self.sp_user.playlist_remove_all_occurrences_of_items, target_id, removals[i:i+100], snapshot_id=snapshot)['snapshot_id']; calls += 1
+        for u in moves:
+            # Place each track directly after its predecessor in the target order
+            k = working.index(u); pos = rank[u]
+            p = working.index(kept_order[pos - 1]) if pos else -1
+            if k == p + 1: continue
+            snapshot = self._api(self.sp_user.playlist_reorder_items, target_id, range_start=k, insert_before=p + 1, snapshot_id=snapshot)['snapshot_id']; calls += 1
+            working.pop(k); working.insert(p + 1 if k > p else p, u)
+        for start, run in add_runs:
+            for i in range(0, len(run), 100):
+                self._api(self.sp_user.playlist_add_items, target_id, run[i:i+100], position=start + i); calls += 1
+        print(f"    > Diff: -{len(removals)} removed, {len(moves)} moved, +{len(uris) - len(working)} added.")
+        print(f"    > {calls} write calls instead of {full_cost} (saved {full_cost - calls}).")
+        return calls
+
+    # --- WORKFLOW SCHEDULING ---
+    def _step_resources(self, step):
+        """Returns (reads, writes): the memory names, local files and playlists a step touches."""
+        action = step.get('action')
+        reads, writes = set(), set()
+        if not action: return reads, writes
+        reads.update(('memory', name) for name in step_inputs(step))
+        writes.add(('memory', step.get('output', 'temp')))
+
+        sources = []
+        if action == 'source': sources = [step['id']]
+        elif action == 'season': sources = [src for c in step.get('cases', []) for src in c.get('sources', [])]
+        for src in sources:
+            reads.add(('file', self._local_path(str(src)))); reads.add(('playlist', self._clean_playlist_id(src)))
+        if action == 'source_file':
+            reads.add(('file', self._local_path(step['filename'])))
+        elif action == 'sync_local_db':
+            writes.add(('file', self._local_path(step['filename'])))
+            if step.get('clear_source', True): writes.update({('playlist', self._clean_playlist_id(step['id'])), ('side_effects',)})
+            else: reads.add(('playlist', self._clean_playlist_id(step['id'])))
+        elif action == 'save':
+            writes.update({('playlist', self._clean_playlist_id(step.get('id', ''))), ('side_effects',)})
+            # shuffle=True reorders the input list in place
+            if step.get('shuffle', False): writes.update(r for r in reads if r[0] == 'memory')
+        elif action == 'filter_audio':
+            # Writes bpm/energy onto the shared track dicts
+            writes.add(('track_attrs',))
+        elif action in ('sort', 'weighted_shuffle'):
+            reads.add(('track_attrs',))
+        return reads, writes
+
+    def build_step_graph(self, steps):
+        """Returns, per step, the indices of earlier steps it has to wait for."""
+        deps = [set() for _ in steps]; last_writer = {}; readers = {}
+        for i, step in enumerate(steps):
+            reads, writes = self._step_resources(step)
+            for res in reads | writes:
+                if res in last_writer: deps[i].add(last_writer[res])
+            for res in writes: deps[i].update(readers.get(res, ()))
+            for res in reads: readers.setdefault(res, set()).add(i)
+            for res in writes: last_writer[res] = i; readers[res] = set()
+            deps[i].discard(i)
+        return deps
+
     def run(self):
         print(f"--- Spotify Mixer Started ---")
         steps = self.config['workflow']
-        for step in steps:
-            action = step.get('action') 
-            output_name = step.get('output', 'temp') 
-            if 'comment' in step: print(f"\n[{step['comment']}]")
-            if not action: continue
+        opts = self.settings.get('scheduler', {})
+        workers = int(opts.get('workers', 4)) if opts.get('parallel', True) else 1
+        self.lazy_sources = []
+        if self.streaming:
+            reads = Counter(name for step in steps for name in step_inputs(step))
+            writes = Counter(step.get('output', 'temp') for step in steps if step.get('action'))
+            self.single_readers = {name for name in reads if reads[name] == 1 and writes[name] == 1}
+        self.plan_releases(steps)
+        if self.offline: self.check_offline(steps)
+        stats_start = {ns: dict(bucket) for ns, bucket in self.cache.stats.items()} if self.cache else {}
+        try:
+            if workers <= 1:
+                for i, step in enumerate(steps):
+                    self._store_result(step, self._run_step(i + 1, step))
+                    self._release_after(i)
+            else:
+                self._run_parallel(steps, workers)
+        finally:
+            if self.cache:
+                print("\n--- Cache Summary ---")
+                for ns in sorted(self.cache.stats): print(f"  - {ns}: {self.cache.report(ns, stats_start)}")
+            if self.profiler: self.profiler.finish(self.cache.stats if self.cache else None)
+
+    def _run_step(self, index, step):
+        if not self.profiler or not step.get('action'): return self.execute_step(step)
+        size_in = sum(known_size(self.memory.get(name)) for name in step_inputs(step))
+        with self.profiler.step(index, step, size_in) as rec:
+            result = self.execute_step(step)
+            rec['out'] = known_size(result) if isinstance(result, (list, LazyTracks)) else 0
+        return result
+
+    def _store_result(self, step, result):
+        if step.get('action'): self.memory[step.get('output', 'temp')] = result
+
+    def plan_releases(self, steps):
+        """
+        Liveness of step outputs: every output is dropped from memory once the last step reading it has run
+        (outputs nobody reads right away). Counted per writing step, so reused names such as 'temp' work too.
+        """
+        last_writer = {}; self.readers_left = {}; self.reads_from = [[] for _ in steps]; self.output_names = {}
+        for i, step in enumerate(steps):
+            for name in set(step_inputs(step)):
+                if name in last_writer:
+                    self.readers_left[last_writer[name]] += 1; self.reads_from[i].append(last_writer[name])
+            if step.get('action'):
+                last_writer[step.get('output', 'temp')] = i; self.readers_left[i] = 0; self.output_names[i] = step.get('output', 'temp')
+
+    def _release_after(self, index):
+        # Runs after the step's result is stored; a later writer of the same name always waits for these readers
+        for w in self.reads_from[index] + ([index] if index in self.readers_left else []):
+            if w != index: self.readers_left[w] -= 1
+            if self.readers_left[w] == 0: self.memory.pop(self.output_names[w], None)
+
+    def _run_parallel(self, steps, workers):
+        deps = self.build_step_graph(steps)
+        waiting = [len(d) for d in deps]; dependents = [[] for _ in steps]
+        for i, d in enumerate(deps):
+            for j in d: dependents[j].append(i)
+        running = {}; error = None
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            def submit(i): running[pool.submit(self._run_step, i + 1, steps[i])] = i
+            for i in range(len(steps)):
+                if waiting[i] == 0: submit(i)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in sorted(done, key=running.get):
+                    i = running.pop(fut)
+                    try: result = fut.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    self._store_result(steps[i], result)
+                    self._release_after(i)
+                    if error: continue
+                    for j in dependents[i]:
+                        waiting[j] -= 1
+                        if waiting[j] == 0: submit(j)
+        if error: raise error
+
+    def execute_step(self, step):
+        action = step.get('action') 
+        output_name = step.get('output', 'temp') 
+        if 'comment' in step: print(f"\n[{step['comment']}]")
+        if not action: return None
 
-            print(f"> Action: {action.upper()} -> {output_name}")
-            result = []
+        print(f"> Action: {action.upper()} -> {output_name}")
+        key = self.memo_key(step)
+        if key:
+            stored = self.cache.get_many('steps', [key]).get(key)
+            if stored is not None:
+                print(f"  - Inputs unchanged: reusing stored result ({len(stored)} tracks).")
+                self.fingerprints[output_name] = key
+                return [Track(t, None, self._intern_artist) for t in stored]
+        self.fingerprints.pop(output_name, None)
+        token, blocked_token = failed_lookups.set([]), blocked_requests.set([])
+        try: result = self.run_action(step)
+        finally:
+            failed, blocked = failed_lookups.get(), blocked_requests.get()
+            failed_lookups.reset(token); blocked_requests.reset(blocked_token)
+        if blocked:
+            # Errors are often caught inside the step; without the network its result would be incomplete
+            raise OfflineError(f"{blocked[0]} Step '{output_name}' ({action}) needs the network.")
+        if key and failed: print(f"  - Not stored for reuse: {', '.join(sorted(set(failed)))} could not be loaded.")
+        elif key and isinstance(result, list):
+            self.cache.put_many('steps', {key: result}, float(self.settings.get('memoize', {}).get('ttl_hours', 24)) * 3600)
+            self.fingerprints[output_name] = key
+        return result
 
-            if action == 'source':
-                result = self.get_tracks(step['id'], step.get('name'), hydrate=step.get('hydrate', 'auto'))
-                print(f"  - Total fetched: {len(result)} tracks.")
+    # --- MEMOIZATION (settings.memoize) ---
+    def memo_key(self, step):
+        """Content address of a step's output: its parameters plus the fingerprints of its inputs. None if not memoizable."""
+        action = step.get('action')
+        if not self.memoize or not (action in PURE_ACTIONS or (action in SEEDED_ACTIONS and 'seed' in step)): return None
+        # Track attributes (filter_audio's bpm/energy) can change after an input's fingerprint was taken
+        fresh = action in ('sort', 'weighted_shuffle')
+        fingerprints = [self.fingerprint(name, fresh) for name in step_inputs(step)]
+        if None in fingerprints: return None
+        params = {k: v for k, v in step.items() if k not in ('output', 'comment')}
+        return hashlib.sha256(json.dumps([MEMO_VERSION, params, fingerprints], sort_keys=True, default=str).encode()).hexdigest()
 
-            elif action == 'source_file':
-                result = self.get_tracks_from_file(step['filename'], hydrate=step.get('hydrate', 'auto'))
-                print(f"  - File: Loaded {len(result)} items.")
+    def fingerprint(self, name, fresh=False):
+        """Memoized outputs are identified by their key; anything else (or with `fresh`) by a hash of its tracks (None while streaming)."""
+        fp = None if fresh else self.fingerprints.get(name)
+        if fp is None:
+            tracks = self.memory.get(name, [])
+            if isinstance(tracks, LazyTracks): return None
+            digest = hashlib.sha256()
+            for t in tracks: digest.update(json.dumps(t, sort_keys=True, default=Track.to_dict).encode())
+            fp = digest.hexdigest()
+            if not fresh: self.fingerprints[name] = fp
+        return fp
 
-            elif action == 'sync_local_db':
-                result = self.sync_local_db(step['id'], step['filename'], step.get('mode', 'append'), step.get('store_type', 'tracks'), step.get('clear_source', step.get('clear_source', True)))
-                print(f"  - Database: Now contains {len(result)} items (including existing).")
+    def run_action(self, step):
+        action = step.get('action')
+        # A step `seed` makes its random choices repeatable (and memoizable)
+        rng = random.Random(step['seed']) if 'seed' in step else random
+        result = []
 
-            elif action == 'slice':
-                result = self.resolve_input(step['input'])[:step['amount']]
+        if action == 'source':
+            result = self._stream_output(step, self.fetch_source(step['id'], step.get('name'), hydrate=step.get('hydrate', 'auto'), lazy=self.streaming))
+            if isinstance(result, LazyTracks): print(f"  - Streaming: {result.total} items, loaded on demand.")
+            else: print(f"  - Total fetched: {len(result)} tracks.")
+
+        elif action == 'source_file':
+            result = self.compact_tracks(self.get_tracks_from_file(step['filename'], hydrate=step.get('hydrate', 'auto')))
+            print(f"  - File: Loaded {len(result)} items.")
+
+        elif action == 'sync_local_db':
+            result = self.sync_local_db(step['id'], step['filename'], step.get('mode', 'append'), step.get('store_type', 'tracks'), step.get('clear_source', step.get('clear_source', True)))
+            print(f"  - Database: Now contains {len(result)} items (including existing).")
+
+        elif action == 'slice':
+            inp = self._input_stream(step['input'])
+            if isinstance(inp, LazyTracks):
+                result = self._derive(step, inp, islice(inp, step['amount']))
+                print(f"  - Sliced to {step['amount']} (streaming).")
+            else:
+                result = inp[:step['amount']]
                 print(f"  - Sliced to {len(result)}.")
 
-            elif action == 'sample':
-                inp = self.resolve_input(step['input'])
-                if inp:
-                    req = step['amount']
-                    result = random.sample(inp, min(len(inp), req))
-                    print(f"  - Random sample: {len(result)} tracks.")
-                else: print("  - Input is empty.")
-
-            elif action == 'mix':
-                for name in step['inputs']: result.extend(self.memory.get(name, []))
-                random.shuffle(result)
-                print(f"  - Mixed: {len(result)} tracks.")
-
-            elif action == 'inject':
-                base = self.resolve_input(step['input'])[:]; to_inject = self.resolve_input(step['inject_input'])[:]
-                interval = step.get('every', 10); variance = step.get('variance', 4)
-                random.shuffle(to_inject); final_list = []; idx_base = 0
-                while idx_base < len(base):
-                    chunk = base[idx_base : idx_base + max(1, interval + random.randint(-variance, variance))]
-                    final_list.extend(chunk); idx_base += len(chunk)
-                    if to_inject and idx_base < len(base): final_list.append(to_inject.pop(0))
-                result = final_list
-                print(f"  - Injection complete. Total: {len(result)}.")
-
-            elif action == 'dedup':
-                seen = set(); result = [t for t in self.resolve_input(step['input']) if not (t['uri'] in seen or seen.add(t['uri']))]
-                print(f"  - Deduplicated: {len(result)} left.")
-
-            elif action == 'filter_exclude':
-                ban_uris = {t['uri'] for t in self.resolve_input(step['exclude_input'])}
-                result = [t for t in self.resolve_input(step['input']) if t['uri'] not in ban_uris]
-                print(f"  - Excluded: {len(result)} left.")
-
-            elif action == 'filter_artist':
-                input_key = step.get('filter_input', step.get('blacklist_input'))
-                filter_list = self.resolve_input(input_key)
-                target_ids = {a['id'] for item in filter_list for a in item.get('artists', [])} | {item['id'] for item in filter_list if 'id' in item and len(item.get('artists', []))==1}
-                if step.get('mode', 'exclude') == 'include':
-                    result = [t for t in self.resolve_input(step['input']) if (set(a['id'] for a in t.get('artists', [])) & target_ids)]
-                else:
-                    result = [t for t in self.resolve_input(step['input']) if not (set(a['id'] for a in t.get('artists', [])) & target_ids)]
-                print(f"  - Artist Filter ({step.get('mode', 'exclude')}): {len(result)} left.")
-
-            elif action == 'filter_genre':
-                inp = self.resolve_input(step['input']); target = [g.lower() for g in step['genres']]
-                a_ids = list({a['id'] for t in inp for a in t.get('artists', [])}); a_map = {}
-                for i in range(0, len(a_ids), 50):
-                    try: 
-                        for a in self.sp_user.artists(a_ids[i:i+50])['artists']: a_map[a['id']] = [x.lower() for x in a['genres']]
-                    except: pass
-                for t in inp:
-                    t_genres = set(g for a in t.get('artists', []) for g in a_map.get(a['id'], []))
-                    match = any(tg for tg in t_genres for k in target if k in tg)
-                    # FIX: Corrected typo in the mode fetching below
-                    filter_mode = step.get('mode', 'exclude')
-                    if (filter_mode == 'include' and match) or (filter_mode == 'exclude' and not match): result.append(t)
-                print(f"  - Genre Filter: {len(result)} left.")
-
-            elif action == 'filter_audio':
-                inp = self.resolve_input(step['input'])
-                print(f"  - Audio Analysis on {len(inp)} tracks...")
-                valid = self._apply_audio_features(inp, self.get_audio_features_reccobeats([t['id'] for t in inp]), step.get('min_bpm',0), step.get('max_bpm',999), step.get('min_energy',0), step.get('max_energy',1))
-                remaining = [t for t in inp if not t.get('_audio_found')]
-                if remaining and not self.spotify_features_disabled:
-                    print(f"    > {len(remaining)} via Spotify API...")
-                    for i in range(0, len(remaining), 100):
-                        if self.spotify_features_disabled: break
-                        try:
-                            feats = self.sp_user.audio_features([t['id'] for t in remaining[i:i+100]])
-                            for j, f in enumerate(feats):
-                                if f and (step.get('min_bpm',0) <= f['tempo'] <= step.get('max_bpm',999)) and (step.get('min_energy',0) <= f['energy'] <= step.get('max_energy',1)):
-                                    t = remaining[i+j]; t['bpm'], t['energy'] = f['tempo'], f['energy']; valid.append(t)
-                        except Exception as e: 
-                            if "403" in str(e): 
-                                self.spotify_features_disabled = True
-                                print("    ! Spotify Audio Features API 403. Disabled.")
-                result = valid if valid or step.get('fallback') == 'none' else inp
-                print(f"  - Audio Filter: {len(result)} left.")
-
-            elif action == 'season':
-                m = datetime.now().month
-                for c in step.get('cases', []):
-                    if m in c['months']:
-                        print(f"      -> Season '{c['name']}' active.")
-                        for src in c['sources']: result.extend(self.get_tracks(src))
-                        break
-                if result and step.get('sample'):
-                    result = random.sample(result, min(len(result), step['sample']))
-                print(f"  - Season result: {len(result)} tracks.")
-
-            elif action == 'weighted_shuffle':
-                inp = self.resolve_input(step['input']); fac = step.get('factor', 50)
-                shuffled = [(t, i + random.uniform(-fac, fac)) for i, t in enumerate(sorted(inp, key=lambda x: x.get(step.get('by', 'popularity'), 0), reverse=True))]
-                result = [x[0] for x in sorted(shuffled, key=lambda x: x[1])]
-
-            elif action == 'artist_separation':
-                inp = self.resolve_input(step['input']); dist = step.get('min_distance', 3)
-                pool = inp[:]; random.shuffle(pool); postponed = []
-                while pool:
-                    t = pool.pop(0); a_ids = {a['id'] for a in t.get('artists', [])}
-                    if any(a_ids & {a['id'] for a in p.get('artists', [])} for p in result[-dist:]): postponed.append(t)
-                    else: result.append(t); pool = [postponed.pop(0)] + pool if postponed else pool
-                result.extend(postponed)
-                print(f"  - Artist separation done. Total: {len(result)}")
-
-            elif action == 'sort':
-                result = sorted(self.resolve_input(step['input']), key=lambda t: t.get(step.get('by', 'popularity'), 0), reverse=step.get('reverse', True))
-
-            elif action == 'save':
-                inp = self.resolve_input(step['input'])
-                
-                # FIX: Clean the target ID before saving so Spotify doesn't reject it
-                raw_target = str(step.get('id', '')).strip()
-                if raw_target.startswith('spotify:playlist:'): raw_target = raw_target.split(':')[-1]
-                elif "spotify.com" in raw_target: raw_target = raw_target.split("/")[-1].split("?")[0]
-                target_id = raw_target
-
-                if step.get('create_new', False) or not target_id:
-                    name, desc = step.get('name', f"Mixer Output {datetime.now().strftime('%Y-%m-%d')}"), step.get('description', "Created by Spotify Mixer")
-                    user_id = self.sp_user.current_user()['id']
-                    print(f"  - Creating NEW playlist '{name}'...")
-                    # Official Spotipy method to create a playlist
-                    new_pl = self.sp_user.user_playlist_create(user=user_id, name=name, public=False, description=desc)
-                    target_id = new_pl['id']
-                
-                if step.get('shuffle', False): random.shuffle(inp)
-                uris = [t['uri'] for t in inp]
-                
-                try:
-                    print(f"  - Saving to {target_id}...")
-                    if uris:
+        elif action == 'sample':
+            inp = self._input_stream(step['input'])
+            if isinstance(inp, LazyTracks):
+                # Loads only the pages holding the picked tracks (reservoir sampling for derived streams)
+                result = inp.sample(step['amount'], rng)
+                print(f"  - Random sample: {len(result)} tracks.")
+            elif inp:
+                req = step['amount']
+                result = rng.sample(inp, min(len(inp), req))
+                print(f"  - Random sample: {len(result)} tracks.")
+            else: print("  - Input is empty.")
+
+        elif action == 'mix':
+            for name in step['inputs']: result.extend(self.memory.get(name, []))
+            rng.shuffle(result)
+            print(f"  - Mixed: {len(result)} tracks.")
+
+        elif action == 'inject':
+            base = self.resolve_input(step['input'])[:]; to_inject = self.resolve_input(step['inject_input'])[:]
+            interval = step.get('every', 10); variance = step.get('variance', 4)
+            rng.shuffle(to_inject); final_list = []; idx_base = 0
+            while idx_base < len(base):
+                chunk = base[idx_base : idx_base + max(1, interval + rng.randint(-variance, variance))]
+                final_list.extend(chunk); idx_base += len(chunk)
+                if to_inject and idx_base < len(base): final_list.append(to_inject.pop(0))
+            result = final_list
+            print(f"  - Injection complete. Total: {len(result)}.")
+
+        elif action == 'dedup':
+            inp = self._input_stream(step['input'])
+            seen = set(); result = self._derive(step, inp, (t for t in inp if not (t['uri'] in seen or seen.add(t['uri']))))
+            print(f"  - Deduplicated: {self._left(result)}.")
+
+        elif action == 'filter_exclude':
+            ban_uris = {t['uri'] for t in self.resolve_input(step['exclude_input'])}
+            inp = self._input_stream(step['input'])
+            result = self._derive(step, inp, (t for t in inp if t['uri'] not in ban_uris))
+            print(f"  - Excluded: {self._left(result)}.")
+
+        elif action == 'filter_artist':
+            input_key = step.get('filter_input', step.get('blacklist_input'))
+            filter_list = self.resolve_input(input_key)
+            target_ids = {a['id'] for item in filter_list for a in item.get('artists', [])} | {item['id'] for item in filter_list if 'id' in item and len(item.get('artists', []))==1}
+            include = step.get('mode', 'exclude') == 'include'
+            inp = self._input_stream(step['input'])
+            result = self._derive(step, inp, (t for t in inp if bool(set(a['id'] for a in t.get('artists', [])) & target_ids) == include))
+            print(f"  - Artist Filter ({step.get('mode', 'exclude')}): {self._left(result)}.")
+
+        elif action == 'filter_genre':
+            inp = self.resolve_input(step['input']); matcher = KeywordMatcher([g.lower() for g in step['genres']])
+            a_map = self.get_artist_genres([a['id'] for t in inp for a in t.get('artists', [])])
+            genre_hits = {}  # Each distinct genre string is matched once
+            filter_mode = step.get('mode', 'exclude')
+            for t in inp:
+                match = False
+                for a in t.get('artists', []):
+                    for g in a_map.get(a['id'], []):
+                        if g not in genre_hits: genre_hits[g] = matcher.search(g)
+                        if genre_hits[g]: match = True; break
+                    if match: break
+                if (filter_mode == 'include' and match) or (filter_mode == 'exclude' and not match): result.append(t)
+            print(f"  - Genre Filter: {len(result)} left.")
+
+        elif action == 'filter_audio':
+            inp = self.resolve_input(step['input'])
+            print(f"  - Audio Analysis on {len(inp)} tracks...")
+            valid = self._apply_audio_features(inp, self.get_audio_features(inp), step.get('min_bpm',0), step.get('max_bpm',999), step.get('min_energy',0), step.get('max_energy',1))
+            result = valid if valid or step.get('fallback') == 'none' else inp
+            print(f"  - Audio Filter: {len(result)} left.")
+
+        elif action == 'season':
+            m = datetime.now().month
+            for c in step.get('cases', []):
+                if m in c['months']:
+                    print(f"      -> Season '{c['name']}' active.")
+                    # Sources are fetched concurrently; results keep the configured order
+                    for tracks in self._parallel_map(self.fetch_source, c['sources']): result.extend(tracks)
+                    break
+            if result and step.get('sample'):
+                result = rng.sample(result, min(len(result), step['sample']))
+            print(f"  - Season result: {len(result)} tracks.")
+
+        elif action == 'weighted_shuffle':
+            inp = self.resolve_input(step['input']); fac = step.get('factor', 50)
+            shuffled = [(t, i + rng.uniform(-fac, fac)) for i, t in enumerate(sorted(inp, key=lambda x: x.get(step.get('by', 'popularity'), 0), reverse=True))]
+            result = [x[0] for x in sorted(shuffled, key=lambda x: x[1])]
+
+        elif action == 'artist_separation':
+            result = self.separate_artists(self.resolve_input(step['input']), step.get('min_distance', 3), rng)
+            print(f"  - Artist separation done. Total: {len(result)}")
+
+        elif action == 'sort':
+            inp = self.resolve_input(step['input'])
+            order = sort_order([t.get(step.get('by', 'popularity'), 0) for t in inp], reverse=step.get('reverse', True))
+            result = [inp[i] for i in order]
+
+        elif action == 'save':
+            # FIX: Clean the target ID before saving so Spotify doesn't reject it
+            target_id = self._clean_playlist_id(step.get('id', ''))
+            if self.streaming: self._settle_sources(target_id)
+            inp = self.resolve_input(step['input'])
+
+            if step.get('create_new', False) or not target_id:
+                name, desc = step.get('name', f"Mixer Output {datetime.now().strftime('%Y-%m-%d')}"), step.get('description', "Created by Spotify Mixer")
+                user_id = self.sp_user.current_user()['id']
+                print(f"  - Creating NEW playlist '{name}'...")
+                # Official Spotipy method to create a playlist
+                new_pl = self.sp_user.user_playlist_create(user=user_id, name=name, public=False, description=desc)
+                target_id = new_pl['id']
+            
+            if step.get('shuffle', False): rng.shuffle(inp)
+            uris = [t['uri'] for t in inp]
+            
+            try:
+                print(f"  - Saving to {target_id}...")
+                if uris:
+                    saved = None
+                    if step.get('mode', 'replace') == 'diff':
+                        try: saved = self.save_playlist_diff(target_id, uris)
+                        except Exception as e: print(f"    ! Diff save failed ({e}). Falling back to full rewrite.")
+                    if saved is None:
                         # Official Spotipy methods: Replace completely empties the playlist and adds up to 100
                         # Passing an empty array safely clears it.
                         self.sp_user.playlist_replace_items(target_id, [])
@@ -487,16 +1927,93 @@ class SpotifyMixer:
                         # Then chunk add the actual tracks
                         for i in range(0, len(uris), 100): 
                             self.sp_user.playlist_add_items(target_id, uris[i:i+100])
-                        print(f"  > SAVED: {len(uris)} tracks.")
-                    else: 
-                        print("  ! Empty list, nothing to save.")
-                except Exception as e: 
-                    print(f"  ! SAVE ERROR: {e}")
-                
-                result = inp
+                    print(f"  > SAVED: {len(uris)} tracks.")
+                else: 
+                    print("  ! Empty list, nothing to save.")
+            except Exception as e: 
+                print(f"  ! SAVE ERROR: {e}")
+            # Other workflows in daemon mode must see the new contents
+            if self.shared: self.shared.forget(target_id)
+            
+            result = inp
+
+        return result
+
+class MixerDaemon:
+    """
+    Runs many workflow configs in one long-lived process (--daemon). Jobs run on an interval or a cron schedule
+    and share one SharedResources: HTTP pool, rate limiters, clients, caches and recent source fetches.
+    Every run re-reads its config file, so edits take effect without a restart.
+    """
+    def __init__(self, daemon_file, mixer_class=SpotifyMixer):
+        path = os.path.abspath(daemon_file)
+        with open(path, 'r') as f: config = json.load(f)
+        opts = config.get('daemon', {})
+        self.shared = SharedResources(float(opts.get('dedup_window_seconds', 600)))
+        self.max_parallel = max(1, int(opts.get('max_parallel', 1)))
+        self.mixer_class = mixer_class
+        self.jobs = []; now = datetime.now()
+        for job in config.get('jobs', []):
+            # Config paths are relative to the daemon file
+            entry = {'config': os.path.join(os.path.dirname(path), job['config']), 'name': job.get('name', job['config']), 'running': False}
+            if 'cron' in job: entry['cron'] = parse_cron(job['cron'])
+            elif 'every_minutes' in job: entry['every'] = timedelta(minutes=float(job['every_minutes']))
+            else: raise ValueError(f"Job '{entry['name']}' needs 'cron' or 'every_minutes'.")
+            # Interval jobs start right away, cron jobs wait for their first slot
+            entry['next'] = now if job.get('run_at_start', 'every' in entry) else self._next(entry, now)
+            self.jobs.append(entry)
 
-            self.memory[output_name] = result
+    def _next(self, job, after):
+        return next_cron(job['cron'], after) if 'cron' in job else after + job['every']
+
+    def run_job(self, job):
+        print(f"\n=== Job: {job['name']} ({datetime.now().strftime('%Y-%m-%d %H:%M')}) ===")
+        try: self.mixer_class(job['config'], shared=self.shared).run()
+        except Exception as e: print(f"  ! JOB FAILED ({job['name']}): {e}")
+        finally: job['running'] = False
+
+    def run(self, once=False):
+        """Runs the jobs on their schedules until interrupted; with `once`, every job runs one time (batch mode)."""
+        print(f"--- Spotify Mixer Daemon: {len(self.jobs)} jobs, {self.max_parallel} at a time ---")
+        if not self.jobs: return
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as pool:
+            try:
+                if once:
+                    list(pool.map(self.run_job, self.jobs))
+                    print(f"\n--- Daemon: {self.shared.dedup_hits} source fetches shared between jobs ---")
+                    return
+                while True:
+                    now = datetime.now()
+                    for job in self.jobs:
+                        if job['next'] > now: continue
+                        job['next'] = self._next(job, now)
+                        # A job still busy from its previous slot skips this one instead of piling up
+                        if job['running']: print(f"  ! Job '{job['name']}' is still running. Skipping this slot.")
+                        else:
+                            job['running'] = True
+                            pool.submit(self.run_job, job)
+                    wake = min(job['next'] for job in self.jobs)
+                    time.sleep(min(60, max(1, (wake - datetime.now()).total_seconds())))
+            except KeyboardInterrupt:
+                print("\n--- Daemon stopping (waiting for running jobs) ---")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2: print("Usage: python spotify_mixer.py config.json")
-    else: SpotifyMixer(sys.argv[1]).run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Runs the workflow defined in a Spotify Mixer config file.")
+    parser.add_argument('config', nargs='?', help="Path to the config JSON file.")
+    parser.add_argument('--profile', nargs='?', const='profiles', metavar='DIR', help="Record per-step metrics; writes a JSON summary and a Chrome/Perfetto trace to DIR (default: profiles).")
+    parser.add_argument('--profile-step', metavar='STEP', help="Also capture a cProfile of one step (its output name or step number).")
+    parser.add_argument('--daemon', metavar='FILE', help="Run the jobs of a daemon file (many configs, on intervals or cron schedules) in one process.")
+    parser.add_argument('--once', action='store_true', help="With --daemon: run every job once and exit (e.g. from cron).")
+    parser.add_argument('--offline', action='store_true', help="Use only local files and caches; steps that need the network fail instead of waiting.")
+    args = parser.parse_args()
+    if args.daemon:
+        MixerDaemon(args.daemon).run(once=args.once)
+    elif not args.config:
+        parser.error("a config file (or --daemon FILE) is required")
+    else:
+        profile = {'enabled': True, 'dir': args.profile} if args.profile else {}
+        if args.profile_step: profile.update(enabled=True, cprofile_step=args.profile_step)
+        try: SpotifyMixer(args.config, profile=profile, offline=args.offline or None).run()
+        except OfflineError as e:
+            print(f"! {e}")
+            sys.exit(1)
\ No newline at end of file